@@ -0,0 +1,111 @@
+import anyio
+import asyncio
+import logging
+import orjson
+import os
+from typing import Optional
+from sqlalchemy.orm import Session
+
+from .database import engine
+from .models import AuditLog, utcnow
+
+logger = logging.getLogger(__name__)
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "50"))
+AUDIT_BATCH_MS = int(os.getenv("AUDIT_BATCH_MS", "50"))
+
+_audit_queue: Optional[asyncio.Queue] = None
+_audit_loop: Optional[asyncio.AbstractEventLoop] = None
+_audit_task: Optional[asyncio.Task] = None
+
+def _write_batch(batch: list):
+    rows_by_table = {}
+    for table, row in batch:
+        rows_by_table.setdefault(table, []).append(row)
+    with engine.begin() as conn:
+        for table, rows in rows_by_table.items():
+            conn.execute(table.insert(), rows)
+
+def _flush(batch: list):
+    try:
+        _write_batch(batch)
+    except Exception:
+        # Un lot refusé ne doit pas perdre les autres lignes : on réessaie ligne par ligne.
+        logger.exception("Audit batch flush failed, retrying %d rows one by one", len(batch))
+        for item in batch:
+            try:
+                _write_batch([item])
+            except Exception:
+                logger.exception("Audit row dropped (%s): %r", item[0].name, item[1])
+
+def log_row(model, row: dict):
+    # Journaux en ajout seul (audit, voix, chatbot) : écrits par lots hors de la requête.
+    row.setdefault("created_at", utcnow())
+    item = (model.__table__, row)
+    if _audit_queue is None:
+        _write_batch([item])
+    else:
+        _audit_loop.call_soon_threadsafe(_audit_queue.put_nowait, item)
+
+def log_audit(boutique_id: str, action: str, table_name: str, record_id: str, ip_address: str, old_values: dict = None, new_values: dict = None):
+    log_row(AuditLog, {
+        "boutique_id": boutique_id,
+        "action": action,
+        "table_name": table_name,
+        "record_id": record_id,
+        "ip_address": ip_address,
+        "old_values": orjson.dumps(old_values).decode() if old_values else None,
+        "new_values": orjson.dumps(new_values).decode() if new_values else None
+    })
+
+def add_audit(db: Session, boutique_id: str, action: str, table_name: str, record_id: str, ip_address: str, old_values: dict = None, new_values: dict = None):
+    db.add(AuditLog(
+        boutique_id=boutique_id,
+        action=action,
+        table_name=table_name,
+        record_id=record_id,
+        ip_address=ip_address,
+        old_values=orjson.dumps(old_values).decode() if old_values else None,
+        new_values=orjson.dumps(new_values).decode() if new_values else None
+    ))
+
+async def _audit_flusher():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        row = await _audit_queue.get()
+        if row is None:
+            break
+        batch = [row]
+        deadline = loop.time() + AUDIT_BATCH_MS / 1000
+        while len(batch) < AUDIT_BATCH_SIZE:
+            try:
+                row = await asyncio.wait_for(_audit_queue.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+        await anyio.to_thread.run_sync(_flush, batch)
+
+def start_audit_writer():
+    global _audit_queue, _audit_loop, _audit_task
+    _audit_loop = asyncio.get_running_loop()
+    _audit_queue = asyncio.Queue()
+    _audit_task = asyncio.create_task(_audit_flusher())
+
+async def stop_audit_writer():
+    global _audit_queue, _audit_loop, _audit_task
+    queue, task = _audit_queue, _audit_task
+    queue.put_nowait(None)
+    await task
+    _audit_queue = _audit_loop = _audit_task = None
+    
+    remaining = []
+    while not queue.empty():
+        row = queue.get_nowait()
+        if row is not None:
+            remaining.append(row)
+    if remaining:
+        await anyio.to_thread.run_sync(_flush, remaining)
@@ -1,76 +1,139 @@
+import anyio
 import bcrypt
 import hashlib
 import os
-from datetime import datetime, timedelta
+import threading
+from cachetools import TTLCache
+from datetime import timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import jwt
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
-from .database import get_db
-from .models import Boutique, Session as SessionModel
+from .database import get_db, SessionLocal
+from .models import Boutique, Session as SessionModel, utcnow
+
+SESSION_PRUNE_INTERVAL_SECONDS = 3600
 
 SECRET_KEY = os.getenv("SESSION_SECRET", "djassa-coach-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 7
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
 
 security = HTTPBearer()
 
-def hash_pin(pin: str) -> tuple[str, str]:
-    salt = bcrypt.gensalt(rounds=12)
-    pin_hash = bcrypt.hashpw(pin.encode(), salt)
-    return pin_hash.decode(), salt.decode()
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "5"))
+
+# token_hash -> (boutique détachée, expiration de la session). Cache propre à chaque
+# processus : les invalidations ci-dessous ne touchent que le worker courant, les
+# autres rattrapent au plus tard après AUTH_CACHE_TTL_SECONDS.
+_auth_cache = TTLCache(maxsize=10_000, ttl=AUTH_CACHE_TTL_SECONDS)
+_auth_cache_lock = threading.Lock()
+
+def invalidate_boutique_sessions(boutique_id: str):
+    with _auth_cache_lock:
+        for token_hash in [k for k, (boutique, _) in _auth_cache.items() if boutique.id == boutique_id]:
+            _auth_cache.pop(token_hash, None)
+
+@event.listens_for(Boutique, "after_update")
+def _evict_updated_boutique(mapper, connection, target):
+    # Plan, features ou statut modifiés : les sessions en cache doivent relire la boutique.
+    invalidate_boutique_sessions(target.id)
+
+def evict_sessions(*token_hashes: bytes):
+    with _auth_cache_lock:
+        for token_hash in token_hashes:
+            _auth_cache.pop(token_hash, None)
+
+@event.listens_for(SessionModel, "after_update")
+def _evict_revoked_session(mapper, connection, target):
+    if target.revoked:
+        evict_sessions(target.token_hash)
+
+@event.listens_for(SessionModel, "after_delete")
+def _evict_deleted_session(mapper, connection, target):
+    evict_sessions(target.token_hash)
+
+def hash_pin(pin: str) -> str:
+    # Le sel bcrypt est inclus dans le hash.
+    return bcrypt.hashpw(pin.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 def verify_pin(pin: str, pin_hash: str) -> bool:
     return bcrypt.checkpw(pin.encode(), pin_hash.encode())
 
-def hash_token(token: str) -> str:
-    return hashlib.sha256(token.encode()).hexdigest()
+async def ahash_pin(pin: str) -> str:
+    return await anyio.to_thread.run_sync(hash_pin, pin)
+
+async def averify_pin(pin: str, pin_hash: str) -> bool:
+    return await anyio.to_thread.run_sync(verify_pin, pin, pin_hash)
+
+def pin_needs_rehash(pin_hash: str) -> bool:
+    return int(pin_hash.split("$")[2]) != BCRYPT_ROUNDS
+
+def hash_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
 
 def create_access_token(boutique_id: str) -> str:
-    expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
+    expire = utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     to_encode = {"sub": boutique_id, "exp": expire}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_boutique(
+# Synchrone : FastAPI l'exécute dans le threadpool, la requête SQL ne bloque pas la boucle.
+def get_current_boutique(
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> Boutique:
+    boutique = getattr(request.state, "boutique", None)
+    if boutique is not None:
+        return boutique
+    
     token = credentials.credentials
+    token_hash = hash_token(token)
+    now = utcnow()
+    
+    with _auth_cache_lock:
+        cached = _auth_cache.get(token_hash)
+    if cached and cached[1] > now:
+        request.state.boutique = db.merge(cached[0], load=False)
+        return request.state.boutique
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        boutique_id: str = payload.get("sub")
-        if boutique_id is None:
-            raise HTTPException(status_code=401, detail="Token invalide")
-    except JWTError:
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=[ALGORITHM],
+            options={"require": ["sub", "exp"], "verify_exp": True}
+        )
+        boutique_id: str = payload["sub"]
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Token invalide ou expiré")
     
-    token_hash = hash_token(token)
-    session = db.query(SessionModel).filter(
+    row = db.query(Boutique, SessionModel.expires_at).join(
+        SessionModel, SessionModel.boutique_id == Boutique.id
+    ).filter(
         SessionModel.token_hash == token_hash,
         SessionModel.revoked == False,
-        SessionModel.expires_at > datetime.utcnow()
-    ).first()
-    
-    if not session:
-        raise HTTPException(status_code=401, detail="Session invalide ou expirée")
-    
-    boutique = db.query(Boutique).filter(
+        SessionModel.expires_at > now,
         Boutique.id == boutique_id,
         Boutique.deleted_at == None,
         Boutique.active == True
     ).first()
     
-    if not boutique:
-        raise HTTPException(status_code=401, detail="Boutique non trouvée")
+    if not row:
+        raise HTTPException(status_code=401, detail="Session invalide ou expirée")
+    
+    boutique, expires_at = row
     
-    return boutique
+    db.expunge(boutique)
+    with _auth_cache_lock:
+        _auth_cache[token_hash] = (boutique, expires_at)
+    
+    request.state.boutique = db.merge(boutique, load=False)
+    return request.state.boutique
 
 def create_session(db: Session, boutique_id: str, token: str, ip_address: str, user_agent: str = None) -> SessionModel:
-    expires_at = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
+    expires_at = utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     session = SessionModel(
         boutique_id=boutique_id,
         token_hash=hash_token(token),
@@ -79,5 +142,18 @@ def create_session(db: Session, boutique_id: str, token: str, ip_address: str, u
         expires_at=expires_at
     )
     db.add(session)
-    db.commit()
     return session
+
+def prune_sessions() -> int:
+    db = SessionLocal()
+    try:
+        # Suppression en masse : pas d'événements ORM, on évince les sessions révoquées à la main.
+        revoked = [token_hash for token_hash, in db.query(SessionModel.token_hash).filter(SessionModel.revoked == True)]
+        deleted = db.query(SessionModel).filter(
+            (SessionModel.expires_at < utcnow()) | (SessionModel.revoked == True)
+        ).delete(synchronize_session=False)
+        db.commit()
+        evict_sessions(*revoked)
+        return deleted
+    finally:
+        db.close()
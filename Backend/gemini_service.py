@@ -1,40 +1,67 @@
 import os
-import json
+import orjson
+import hashlib
+import threading
+from string import Template
+from functools import lru_cache
+from cachetools import TTLCache
 from google import genai
 from google.genai import types
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
+
+from .schemas import TransactionIntent, VoiceParseResult
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+_gemini_cache = TTLCache(maxsize=5000, ttl=3600)
+_gemini_cache_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
 def get_client():
     if GOOGLE_API_KEY:
         return genai.Client(api_key=GOOGLE_API_KEY)
     return None
 
-def detect_transaction_intent(message: str, produits: list, language: str = "fr") -> dict:
-    """Detect if the message contains a transaction intent (sale, expense, debt)"""
-    client = get_client()
-    if not client:
-        return {"has_transaction": False, "error": "API not configured"}
-    
-    produits_list = ", ".join([f"{p['nom']} ({p['prix_unitaire']} FCFA)" for p in produits[:30]])
-    
-    is_english = language == "en"
-    
-    if is_english:
-        prompt = f"""You are an expert assistant at extracting transaction intents.
-Analyze this message and determine if it contains an intent to record a transaction (sale, expense, debt).
+async def _cached_generate(client, model: str, prompt: str, system_instruction: Optional[str] = None, response_schema: Optional[type] = None) -> str:
+    schema_name = response_schema.__name__ if response_schema else ""
+    key = hashlib.sha256(f"{model}\0{schema_name}\0{system_instruction or ''}\0{prompt}".encode()).hexdigest()
+    with _gemini_cache_lock:
+        text = _gemini_cache.get(key)
+    if text is None:
+        config = None
+        if system_instruction or response_schema:
+            config = types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                response_mime_type="application/json" if response_schema else None,
+                response_schema=response_schema
+            )
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=config
+        )
+        text = response.text or ""
+        if text:
+            with _gemini_cache_lock:
+                _gemini_cache[key] = text
+    return text
 
-Message: "{message}"
+@lru_cache(maxsize=256)
+def _format_produits(produits: tuple) -> str:
+    return ", ".join(f"{nom} ({prix} FCFA)" for nom, prix in produits)
 
-Products available in the shop:
-{produits_list}
+def _produits_key(produits: list, limit: int) -> tuple:
+    return tuple((p['nom'], p['prix_unitaire']) for p in produits[:limit])
+
+INTENT_SYSTEM_INSTRUCTIONS = {
+    "en": """You are an expert assistant at extracting transaction intents.
+Analyze this message and determine if it contains an intent to record a transaction (sale, expense, debt).
 
 Respond ONLY with valid JSON in this exact format:
-{{
+{
     "has_transaction": true/false,
     "transaction_type": "vente" | "depense" | "dette" | null,
-    "details": {{
+    "details": {
         "produit_nom": "exact product name or null",
         "quantite": number or null,
         "prix_unitaire": price in FCFA or null,
@@ -42,33 +69,25 @@ Respond ONLY with valid JSON in this exact format:
         "client_nom": "client name for debt or null",
         "description": "expense description or null",
         "categorie": "expense category or null"
-    }},
+    },
     "confidence": 0.0-1.0,
     "missing_info": ["list of missing info"]
-}}
+}
 
 Examples:
 - "Sold 2 bags of rice at 15000" -> sale, product: rice, quantity: 2, price: 15000
 - "I sold 3 soaps" -> sale, product: soap, quantity: 3
 - "Expense electricity 20000 FCFA" -> expense, description: electricity, amount: 20000
 - "Mamadou owes me 5000 francs" -> debt, client: Mamadou, amount: 5000
-- "What's my profit?" -> has_transaction: false
-
-JSON:"""
-    else:
-        prompt = f"""Tu es un assistant expert en extraction d'intentions de transaction.
+- "What's my profit?" -> has_transaction: false""",
+    "fr": """Tu es un assistant expert en extraction d'intentions de transaction.
 Analyse ce message et détermine s'il contient une intention d'enregistrer une transaction (vente, dépense, dette).
 
-Message: "{message}"
-
-Produits disponibles dans la boutique:
-{produits_list}
-
 Réponds UNIQUEMENT en JSON valide avec ce format:
-{{
+{
     "has_transaction": true/false,
     "transaction_type": "vente" | "depense" | "dette" | null,
-    "details": {{
+    "details": {
         "produit_nom": "nom du produit ou null",
         "quantite": nombre ou null,
         "prix_unitaire": prix en FCFA ou null,
@@ -76,44 +95,53 @@ Réponds UNIQUEMENT en JSON valide avec ce format:
         "client_nom": "nom du client pour dette ou null",
         "description": "description de la dépense ou null",
         "categorie": "categorie de dépense ou null"
-    }},
+    },
     "confidence": 0.0-1.0,
     "missing_info": ["liste des infos manquantes"]
-}}
+}
 
 Exemples:
 - "Vendu 2 sacs de riz à 15000" -> vente, produit: riz, quantite: 2, prix: 15000
 - "J'ai vendu 3 savons" -> vente, produit: savon, quantite: 3
 - "Dépense électricité 20000 FCFA" -> dépense, description: électricité, montant: 20000
 - "Mamadou me doit 5000 francs" -> dette, client: Mamadou, montant: 5000
-- "Quel est mon bénéfice?" -> has_transaction: false
+- "Quel est mon bénéfice?" -> has_transaction: false"""
+}
+
+async def detect_transaction_intent(message: str, produits: list, language: str = "fr") -> dict:
+    """Detect if the message contains a transaction intent (sale, expense, debt)"""
+    client = get_client()
+    if not client:
+        return {"has_transaction": False, "error": "API not configured"}
+    
+    produits_list = _format_produits(_produits_key(produits, 30))
+    
+    # Le bloc produits, stable d'un message à l'autre, passe avant le message
+    # pour que le préfixe de la requête reste identique.
+    if language == "en":
+        system_instruction = INTENT_SYSTEM_INSTRUCTIONS["en"]
+        prompt = f"""Products available in the shop:
+{produits_list}
+
+Message: "{message}"
+
+JSON:"""
+    else:
+        system_instruction = INTENT_SYSTEM_INSTRUCTIONS["fr"]
+        prompt = f"""Produits disponibles dans la boutique:
+{produits_list}
+
+Message: "{message}"
 
 JSON:"""
 
     try:
-        response = client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=prompt
-        )
-        
-        text = (response.text or "").strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        
-        import re
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return result
-        return {"has_transaction": False}
+        text = await _cached_generate(client, 'gemini-1.5-flash', prompt, system_instruction=system_instruction, response_schema=TransactionIntent)
+        return orjson.loads(text)
     except Exception as e:
         return {"has_transaction": False, "error": str(e)}
 
-def parse_voice_input(transcript: str, produits: list) -> dict:
+async def parse_voice_input(transcript: str, produits: list) -> dict:
     client = get_client()
     if not client:
         return {
@@ -121,7 +149,7 @@ def parse_voice_input(transcript: str, produits: list) -> dict:
             "error": "API Gemini non configurée"
         }
     
-    produits_list = ", ".join([f"{p['nom']} ({p['prix_unitaire']} FCFA)" for p in produits[:20]])
+    produits_list = _format_produits(_produits_key(produits, 20))
     
     prompt = f"""Tu es un assistant pour une application de gestion de boutique ivoirienne.
 Analyse cette transcription vocale et extrait les informations de vente.
@@ -149,22 +177,9 @@ Exemples de transcriptions valides:
 Réponds uniquement avec le JSON, pas d'explication."""
 
     try:
-        response = client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=prompt
-        )
-        
-        text = (response.text or "").strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        
-        result = json.loads(text.strip())
-        return result
-    except json.JSONDecodeError:
+        text = await _cached_generate(client, 'gemini-1.5-flash', prompt, response_schema=VoiceParseResult)
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
         return {
             "success": False,
             "error": "Réponse IA invalide"
@@ -175,11 +190,20 @@ Réponds uniquement avec le JSON, pas d'explication."""
             "error": str(e)
         }
 
+async def generate_chatbot_response(prompt: str, use_cache: bool = True) -> str:
+    client = get_client()
+    if use_cache:
+        return await _cached_generate(client, 'gemini-1.5-flash', prompt)
+    response = await client.aio.models.generate_content(
+        model='gemini-1.5-flash',
+        contents=prompt
+    )
+    return response.text or ""
+
 def format_fcfa(montant: int) -> str:
-    formatted = f"{montant:,}".replace(",", " ")
-    return f"{formatted} FCFA"
+    return f"{montant:,} FCFA".replace(",", " ")
 
-CECILE_SYSTEM_PROMPT = """Tu es Cécile, une assistante IA chaleureuse et experte pour l'application Djassa Coach, 
+CECILE_SYSTEM_INSTRUCTION = """Tu es Cécile, une assistante IA chaleureuse et experte pour l'application Djassa Coach, 
 une application de gestion financière pour les commerçants ivoiriens.
 
 Tu parles français avec un style amical et accessible, adapté aux commerçants de Côte d'Ivoire.
@@ -191,12 +215,9 @@ Tu peux utiliser occasionnellement des expressions locales ivoiriennes pour cré
 3. AIDER à enregistrer des transactions par la voix
 4. MOTIVER et encourager l'entrepreneur
 
-📊 DONNÉES FINANCIÈRES DE LA BOUTIQUE "{nom_boutique}":
-{financial_data}
-
 📝 RÈGLES IMPORTANTES:
 - Sois concise mais chaleureuse (réponses de 2-4 phrases max)
-- Utilise les vraies données ci-dessus pour répondre aux questions
+- Utilise les vraies données financières de la boutique fournies dans le message pour répondre aux questions
 - Si on te demande "mes ventes", réponds avec les chiffres réels
 - Si on te demande "mes dettes", liste les clients endettés
 - Pour enregistrer une vente/dépense, guide l'utilisateur vers la bonne page
@@ -207,12 +228,29 @@ Tu peux utiliser occasionnellement des expressions locales ivoiriennes pour cré
 🗣️ EXEMPLES DE RÉPONSES:
 - "Tes ventes aujourd'hui: 45 000 FCFA. C'est bien parti ! 💪"
 - "Tu as 3 dettes en cours pour un total de 25 000 FCFA."
-- "Conseil: Essaie de relancer Amadou qui doit 10 000 FCFA depuis 15 jours."
+- "Conseil: Essaie de relancer Amadou qui doit 10 000 FCFA depuis 15 jours.\""""
+
+CECILE_CONTEXT_PROMPT = Template("""📊 DONNÉES FINANCIÈRES DE LA BOUTIQUE "${nom_boutique}":
+${financial_data}
 
 Historique de conversation:
-{history}"""
+${history}""")
+
+def _build_cecile_prompt(message: str, context: dict, history: Optional[List[dict]]) -> str:
+    history_str = "".join(
+        f"{'Utilisateur' if msg.get('role') == 'user' else 'Cécile'}: {msg.get('content', '')}\n"
+        for msg in (history or [])[-10:]
+    )
+    
+    context_prompt = CECILE_CONTEXT_PROMPT.substitute(
+        nom_boutique=context.get('nom_boutique', 'Ma Boutique'),
+        financial_data=context.get('financial_data', ''),
+        history=history_str
+    )
+    
+    return f"{context_prompt}\n\nUtilisateur: {message}\n\nCécile:"
 
-def chat_with_cecile(message: str, context: dict, history: Optional[List[dict]] = None, financial_data: str = "") -> dict:
+async def chat_with_cecile(message: str, context: dict, history: Optional[List[dict]] = None, financial_data: str = "") -> dict:
     client = get_client()
     if not client:
         return {
@@ -221,31 +259,14 @@ def chat_with_cecile(message: str, context: dict, history: Optional[List[dict]]
             "response": None
         }
     
-    if history is None:
-        history = []
-    
-    history_str = ""
-    for msg in history[-10:]:
-        role = "Utilisateur" if msg.get("role") == "user" else "Cécile"
-        history_str += f"{role}: {msg.get('content', '')}\n"
-    
-    system_prompt = CECILE_SYSTEM_PROMPT.format(
-        nom_boutique=context.get('nom_boutique', 'Ma Boutique'),
-        financial_data=financial_data,
-        history=history_str
-    )
-    
-    full_prompt = f"{system_prompt}\n\nUtilisateur: {message}\n\nCécile:"
+    full_prompt = _build_cecile_prompt(message, {**context, "financial_data": financial_data}, history)
     
     try:
-        response = client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=full_prompt
-        )
+        text = await _cached_generate(client, 'gemini-1.5-flash', full_prompt, system_instruction=CECILE_SYSTEM_INSTRUCTION)
         
         return {
             "success": True,
-            "response": (response.text or "").strip(),
+            "response": text.strip(),
             "error": None
         }
     except Exception as e:
@@ -254,3 +275,136 @@ def chat_with_cecile(message: str, context: dict, history: Optional[List[dict]]
             "error": str(e),
             "response": None
         }
+
+async def stream_chat_with_cecile(message: str, context: dict, history: Optional[List[dict]] = None, financial_data: str = "") -> AsyncIterator[str]:
+    client = get_client()
+    if not client:
+        raise RuntimeError("API Gemini non configurée. Veuillez configurer la clé GOOGLE_API_KEY.")
+    
+    full_prompt = _build_cecile_prompt(message, {**context, "financial_data": financial_data}, history)
+    
+    stream = await client.aio.models.generate_content_stream(
+        model='gemini-1.5-flash',
+        contents=full_prompt,
+        config=types.GenerateContentConfig(system_instruction=CECILE_SYSTEM_INSTRUCTION)
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+
+CHATBOT_CONTEXT_PROMPT = Template("""
+CONTEXTE BOUTIQUE :
+- Nom : ${nom}
+- Plan : ${plan}
+
+DONNÉES DU JOUR :
+- Ventes aujourd'hui : ${ventes_jour}
+- Dépenses aujourd'hui : ${depenses_jour}
+- Bénéfice aujourd'hui : ${benefice_jour}
+
+BILAN DE LA SEMAINE :
+- Ventes 7 jours : ${ventes_semaine}
+- Dépenses 7 jours : ${depenses_semaine}
+- Bénéfice net : ${benefice_semaine}
+
+DETTES EN COURS (${nb_dettes} clients):
+${dettes}
+Total dettes: ${dettes_totales} (${dettes_critiques} en retard > 15 jours)
+
+VENTES RÉCENTES:
+${ventes_recentes}
+
+ALERTES STOCK (${stock_alertes} produits):
+${stock}
+""")
+
+CHATBOT_PROMPTS = {
+    "en": Template("""You are Cécile, an intelligent financial assistant for Djassa Coach, an app for Ivorian merchants.
+
+${context}
+
+YOUR ROLE:
+- Help merchants manage their business
+- Respond in simple, accessible English
+- Be friendly, encouraging and proactive
+- Give actionable advice
+- Use emojis sparingly (1-2 max)
+- Offer concrete suggestions
+
+CAPABILITIES:
+- Analyze sales and give insights
+- Advise on debt management
+- Suggest savings
+- Alert on low stock
+- Calculate margins and profits
+- Remind about critical debts
+
+STYLE:
+- Reply briefly (2-3 sentences max unless detailed analysis requested)
+- Be positive and motivating
+- Avoid complex financial jargon
+
+RECENT HISTORY:
+${history}
+
+NEW USER MESSAGE:
+${message}
+
+INSTRUCTIONS:
+1. Respond naturally and conversationally
+2. If user asks for numbers, use the context stats
+3. If needed, suggest 2-3 quick actions
+4. Maintain an encouraging and professional tone
+
+RESPONSE (JSON format):
+{
+    "response": "your response here",
+    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
+    "proactive_advice": "optional proactive advice if situation warrants it or null"
+}"""),
+    "fr": Template("""Tu es Cécile, l'assistante financière intelligente de Djassa Coach pour les commerçants ivoiriens.
+
+${context}
+
+TON RÔLE :
+- Aide le commerçant à gérer son business
+- Réponds en français simple et accessible
+- Sois amicale, encourageante et proactive
+- Donne des conseils actionnables
+- Utilise des emojis avec parcimonie (1-2 max)
+- Propose des suggestions concrètes
+
+CAPACITÉS :
+- Analyser les ventes et donner des insights
+- Conseiller sur la gestion des dettes
+- Suggérer des économies
+- Alerter sur les stocks bas
+- Calculer des marges et profits
+- Rappeler les dettes critiques
+
+STYLE :
+- Réponds brièvement (2-3 phrases max sauf si analyse demandée)
+- Tutoie l'utilisateur
+- Sois positive et motivante
+- Évite le jargon financier complexe
+
+HISTORIQUE RÉCENT :
+${history}
+
+NOUVEAU MESSAGE UTILISATEUR :
+${message}
+
+INSTRUCTIONS :
+1. Réponds de manière naturelle et conversationnelle
+2. Si l'utilisateur demande des chiffres, utilise les stats du contexte
+3. Si nécessaire, propose 2-3 suggestions d'actions rapides
+4. Garde un ton encourageant et professionnel
+5. Si les dépenses dépassent les ventes cette semaine, donne un conseil proactif
+
+RÉPONSE (format JSON) :
+{
+    "response": "ta réponse ici",
+    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
+    "proactive_advice": "conseil proactif optionnel si la situation le justifie ou null"
+}""")
+}
@@ -1,62 +1,91 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import datetime, timedelta, date
-import json
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, case, insert
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+import asyncio
+import logging
+import orjson
 import os
+import time
 
-from .database import engine, get_db, Base
-from .models import Boutique, Produit, Vente, Depense, Dette, PaiementDette, Objectif, VoiceLog, AuditLog, ChatMessage, ChatLog, FrequentDepense, DepenseCategory
+from .database import get_db, SessionLocal
+from .migrate import migrate
+from . import queries, quota
+from .audit import log_audit, log_row, add_audit, start_audit_writer, stop_audit_writer
+from .models import Boutique, Produit, Vente, Depense, Dette, PaiementDette, Objectif, VoiceLog, ChatMessage, ChatLog, FrequentDepense, DepenseCategory, DailyBoutiqueStats, utcnow, normalize_nom
 from .schemas import (
     SignupRequest, LoginRequest, VerifyPinRequest, TokenResponse, DashboardResponse,
     ProduitCreate, ProduitResponse, VenteCreate, VenteResponse,
     DepenseCreate, DepenseResponse, DetteCreate, DetteResponse,
     PaiementDetteCreate, ObjectifCreate, VoiceParseRequest, VoiceParseResponse,
-    ChatRequest, ChatResponse, DepenseCategoryCreate
+    ChatRequest, ChatResponse, DepenseCategoryCreate, ChatbotRequest
 )
 from .auth import (
-    hash_pin, verify_pin, create_access_token, get_current_boutique, create_session
+    ahash_pin, averify_pin, pin_needs_rehash, create_access_token, get_current_boutique, create_session,
+    prune_sessions, SESSION_PRUNE_INTERVAL_SECONDS
+)
+from .gemini_service import (
+    get_client, parse_voice_input, chat_with_cecile, stream_chat_with_cecile, detect_transaction_intent,
+    generate_chatbot_response, format_fcfa, CHATBOT_CONTEXT_PROMPT, CHATBOT_PROMPTS
 )
-from .gemini_service import parse_voice_input, chat_with_cecile, detect_transaction_intent
 
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-limiter = Limiter(key_func=get_remote_address)
-app = FastAPI(title="Djassa Coach API", version="1.0.0")
+async def prune_sessions_periodically():
+    while True:
+        try:
+            await run_in_threadpool(prune_sessions)
+        except Exception:
+            logger.exception("Session prune failed")
+        await asyncio.sleep(SESSION_PRUNE_INTERVAL_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Désactivé (AUTO_MIGRATE=0) quand run.py a déjà migré avant de lancer plusieurs workers.
+    if os.getenv("AUTO_MIGRATE", "1") != "0":
+        await run_in_threadpool(migrate)
+    start_audit_writer()
+    prune_task = asyncio.create_task(prune_sessions_periodically())
+    yield
+    prune_task.cancel()
+    await stop_audit_writer()
+
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI", "memory://"),
+    strategy="moving-window"
+)
+app = FastAPI(title="Djassa Coach API", version="1.0.0", lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
+# Le jeton passe par l'en-tête Authorization : pas de credentials avec l'origine "*".
+CORS_ALLOW_CREDENTIALS = "*" not in CORS_ORIGINS
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=CORS_ALLOW_CREDENTIALS,
+    allow_methods=["GET", "POST", "PATCH", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
-def format_fcfa(montant: int) -> str:
-    formatted = f"{montant:,}".replace(",", " ")
-    return f"{formatted} FCFA"
-
-def log_audit(db: Session, boutique_id: str, action: str, table_name: str, record_id: str, ip_address: str, old_values: dict = None, new_values: dict = None):
-    audit = AuditLog(
-        boutique_id=boutique_id,
-        action=action,
-        table_name=table_name,
-        record_id=record_id,
-        ip_address=ip_address,
-        old_values=json.dumps(old_values) if old_values else None,
-        new_values=json.dumps(new_values) if new_values else None
-    )
-    db.add(audit)
-    db.commit()
-
 @app.post("/api/auth/signup", response_model=TokenResponse)
 @limiter.limit("5/minute")
 async def signup(request: Request, data: SignupRequest, db: Session = Depends(get_db)):
@@ -68,25 +97,24 @@ async def signup(request: Request, data: SignupRequest, db: Session = Depends(ge
     if existing:
         raise HTTPException(status_code=409, detail="Ce numéro de téléphone est déjà enregistré")
     
-    pin_hash, pin_salt = hash_pin(data.pin)
+    pin_hash = await ahash_pin(data.pin)
     
     boutique = Boutique(
         nom=data.nom_boutique,
         telephone=data.telephone,
         pin_hash=pin_hash,
-        pin_salt=pin_salt,
         last_login_ip=request.client.host
     )
     db.add(boutique)
-    db.commit()
-    db.refresh(boutique)
+    db.flush()
     
     token = create_access_token(boutique.id)
     create_session(db, boutique.id, token, request.client.host, request.headers.get("user-agent"))
+    db.commit()
     
-    log_audit(db, boutique.id, "signup", "boutiques", boutique.id, request.client.host)
+    log_audit(boutique.id, "signup", "boutiques", boutique.id, request.client.host)
     
-    features = json.loads(boutique.features_json)
+    features = boutique.features
     
     return TokenResponse(
         boutique_id=boutique.id,
@@ -107,28 +135,32 @@ async def login(request: Request, data: LoginRequest, db: Session = Depends(get_
     if not boutique:
         raise HTTPException(status_code=401, detail="Identifiants incorrects")
     
-    if boutique.locked_until and boutique.locked_until > datetime.utcnow():
+    now = utcnow()
+    if boutique.locked_until and boutique.locked_until > now:
         raise HTTPException(status_code=423, detail="Compte temporairement bloqué")
     
-    if not verify_pin(data.pin, boutique.pin_hash):
+    if not await averify_pin(data.pin, boutique.pin_hash):
         boutique.failed_login_attempts += 1
         if boutique.failed_login_attempts >= 3:
-            boutique.locked_until = datetime.utcnow() + timedelta(minutes=15)
+            boutique.locked_until = now + timedelta(minutes=15)
         db.commit()
         raise HTTPException(status_code=401, detail="Identifiants incorrects")
     
+    if pin_needs_rehash(boutique.pin_hash):
+        boutique.pin_hash = await ahash_pin(data.pin)
+    
     boutique.failed_login_attempts = 0
     boutique.locked_until = None
-    boutique.last_login_at = datetime.utcnow()
+    boutique.last_login_at = now
     boutique.last_login_ip = request.client.host
-    db.commit()
     
     token = create_access_token(boutique.id)
     create_session(db, boutique.id, token, request.client.host, request.headers.get("user-agent"))
+    db.commit()
     
-    log_audit(db, boutique.id, "login", "boutiques", boutique.id, request.client.host)
+    log_audit(boutique.id, "login", "boutiques", boutique.id, request.client.host)
     
-    features = json.loads(boutique.features_json)
+    features = boutique.features
     
     return TokenResponse(
         boutique_id=boutique.id,
@@ -137,89 +169,56 @@ async def login(request: Request, data: LoginRequest, db: Session = Depends(get_
         nom_boutique=boutique.nom
     )
 
-@app.post("/api/auth/verify-pin")
+@app.post("/api/auth/verify-pin", response_class=OrjsonResponse)
 async def verify_pin_endpoint(
     request: Request,
     data: VerifyPinRequest,
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    if not verify_pin(data.pin, boutique.pin_hash):
-        log_audit(db, boutique.id, "failed_pin_verify", "boutiques", boutique.id, request.client.host)
+    if not await averify_pin(data.pin, boutique.pin_hash):
+        log_audit(boutique.id, "failed_pin_verify", "boutiques", boutique.id, request.client.host)
         raise HTTPException(status_code=401, detail="Code PIN incorrect")
     
-    log_audit(db, boutique.id, "pin_verified", "boutiques", boutique.id, request.client.host)
+    log_audit(boutique.id, "pin_verified", "boutiques", boutique.id, request.client.host)
     return {"success": True}
 
 @app.get("/api/dashboard", response_model=DashboardResponse)
-async def get_dashboard(
+def get_dashboard(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    
-    ventes_aujourdhui = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-        Vente.boutique_id == boutique.id,
-        Vente.date_vente >= today_start,
-        Vente.date_vente <= today_end,
-        Vente.deleted_at == None
-    ).scalar()
-    
-    depenses_aujourdhui = db.query(func.coalesce(func.sum(Depense.montant), 0)).filter(
-        Depense.boutique_id == boutique.id,
-        Depense.date_depense >= today_start,
-        Depense.date_depense <= today_end,
-        Depense.deleted_at == None
-    ).scalar()
+    now = utcnow()
+    today = now.date()
     
-    dettes_totales = db.query(func.coalesce(func.sum(Dette.montant_restant), 0)).filter(
-        Dette.boutique_id == boutique.id,
-        Dette.statut == 'en_cours',
-        Dette.deleted_at == None
-    ).scalar()
+    limite_critique = now - timedelta(days=15)
     
-    limite_critique = datetime.utcnow() - timedelta(days=15)
-    dettes_critiques = db.query(func.count(Dette.id)).filter(
-        Dette.boutique_id == boutique.id,
-        Dette.statut == 'en_cours',
-        Dette.date_creation <= limite_critique,
-        Dette.deleted_at == None
-    ).scalar()
+    ventes_aujourdhui, depenses_aujourdhui, dettes_totales, dettes_critiques, stock_alertes = db.execute(queries.dashboard_totaux, {
+        "boutique_id": boutique.id,
+        "jour": today,
+        "limite_critique": limite_critique
+    }).one()
     
-    stock_alertes = db.query(func.count(Produit.id)).filter(
-        Produit.boutique_id == boutique.id,
-        Produit.quantite_stock <= Produit.seuil_alerte,
-        Produit.active == True,
-        Produit.deleted_at == None
-    ).scalar()
+    montants_par_jour = dict(db.query(DailyBoutiqueStats.jour, DailyBoutiqueStats.ventes_total).filter(
+        DailyBoutiqueStats.boutique_id == boutique.id,
+        DailyBoutiqueStats.jour >= today - timedelta(days=6)
+    ).all())
     
     ventes_7_jours = []
     for i in range(6, -1, -1):
         date = today - timedelta(days=i)
-        date_start = datetime.combine(date, datetime.min.time())
-        date_end = datetime.combine(date, datetime.max.time())
-        
-        montant = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-            Vente.boutique_id == boutique.id,
-            Vente.date_vente >= date_start,
-            Vente.date_vente <= date_end,
-            Vente.deleted_at == None
-        ).scalar()
-        
         ventes_7_jours.append({
             "date": date.strftime("%Y-%m-%d"),
             "jour": ["Dim", "Lun", "Mar", "Mer", "Jeu", "Ven", "Sam"][date.weekday()],
-            "montant": montant
+            "montant": montants_par_jour.get(date, 0)
         })
     
     objectif_actif = None
     objectif = db.query(Objectif).filter(
         Objectif.boutique_id == boutique.id,
         Objectif.active == True,
-        Objectif.date_debut <= datetime.utcnow(),
-        Objectif.date_fin >= datetime.utcnow(),
+        Objectif.date_debut <= now,
+        Objectif.date_fin >= now,
         Objectif.deleted_at == None
     ).first()
     
@@ -250,12 +249,14 @@ async def get_dashboard(
         objectif_actif=objectif_actif
     )
 
-@app.get("/api/produits")
-async def get_produits(
+@app.get("/api/produits", response_class=OrjsonResponse)
+def get_produits(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    produits = db.query(Produit).filter(
+    produits = db.query(
+        Produit.id, Produit.nom, Produit.prix_unitaire, Produit.quantite_stock, Produit.seuil_alerte, Produit.categorie
+    ).filter(
         Produit.boutique_id == boutique.id,
         Produit.active == True,
         Produit.deleted_at == None
@@ -270,8 +271,8 @@ async def get_produits(
         "categorie": p.categorie
     } for p in produits]
 
-@app.post("/api/produits")
-async def create_produit(
+@app.post("/api/produits", response_class=OrjsonResponse)
+def create_produit(
     request: Request,
     data: ProduitCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -295,15 +296,16 @@ async def create_produit(
         categorie=data.categorie
     )
     db.add(produit)
-    db.commit()
-    db.refresh(produit)
+    db.flush()
     
-    log_audit(db, boutique.id, "create_product", "produits", produit.id, request.client.host)
+    add_audit(db, boutique.id, "create_product", "produits", produit.id, request.client.host)
+    db.commit()
+    queries.invalidate_produits_catalogue(boutique.id)
     
     return {"id": produit.id, "nom": produit.nom, "prix_unitaire": produit.prix_unitaire}
 
-@app.patch("/api/produits/{produit_id}/stock")
-async def update_stock(
+@app.patch("/api/produits/{produit_id}/stock", response_class=OrjsonResponse)
+def update_stock(
     request: Request,
     produit_id: str,
     ajustement: int,
@@ -328,8 +330,8 @@ async def update_stock(
     
     return {"nouvelle_quantite": nouvelle_quantite}
 
-@app.delete("/api/produits/{produit_id}")
-async def delete_produit(
+@app.delete("/api/produits/{produit_id}", response_class=OrjsonResponse)
+def delete_produit(
     produit_id: str,
     request: Request,
     boutique: Boutique = Depends(get_current_boutique),
@@ -344,46 +346,53 @@ async def delete_produit(
     if not produit:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     
-    produit.deleted_at = datetime.utcnow()
+    produit.deleted_at = utcnow()
     produit.active = False
-    db.commit()
-    
-    log_audit(db, boutique.id, "delete_product", "produits", produit.id, request.client.host,
+    add_audit(db, boutique.id, "delete_product", "produits", produit.id, request.client.host,
               old_values={"nom": produit.nom, "stock": produit.quantite_stock})
+    db.commit()
+    queries.invalidate_produits_catalogue(boutique.id)
     
     return {"success": True}
 
-@app.get("/api/ventes")
-async def get_ventes(
+@app.get("/api/ventes", response_class=OrjsonResponse)
+def get_ventes(
     limit: int = 20,
     offset: int = 0,
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    ventes = db.query(Vente).filter(
+    ventes = db.query(
+        Vente.id, Vente.quantite, Vente.montant_total, Vente.date_vente,
+        Produit.id.label("produit_id"), Produit.nom.label("produit_nom")
+    ).join(Produit, Vente.produit_id == Produit.id).filter(
         Vente.boutique_id == boutique.id,
         Vente.deleted_at == None
-    ).order_by(Vente.date_vente.desc()).offset(offset).limit(limit).all()
+    ).order_by(Vente.date_vente.desc()).offset(offset).limit(limit + 1).all()
     
-    total = db.query(func.count(Vente.id)).filter(
-        Vente.boutique_id == boutique.id,
-        Vente.deleted_at == None
-    ).scalar()
+    has_next = len(ventes) > limit
+    ventes = ventes[:limit]
     
     return {
         "ventes": [{
             "id": v.id,
-            "produit": {"id": v.produit.id, "nom": v.produit.nom},
+            "produit": {"id": v.produit_id, "nom": v.produit_nom},
             "quantite": v.quantite,
             "montant_total": v.montant_total,
             "date_vente": v.date_vente.isoformat()
         } for v in ventes],
-        "total": total,
-        "has_next": offset + limit < total
+        "has_next": has_next
     }
 
-@app.post("/api/ventes")
-async def create_vente(
+@app.get("/api/ventes/count", response_class=OrjsonResponse)
+def count_ventes(
+    boutique: Boutique = Depends(get_current_boutique),
+    db: Session = Depends(get_db)
+):
+    return {"total": db.execute(queries.ventes_count, {"boutique_id": boutique.id}).scalar()}
+
+@app.post("/api/ventes", response_class=OrjsonResponse)
+def create_vente(
     request: Request,
     data: VenteCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -415,11 +424,12 @@ async def create_vente(
     produit.quantite_stock -= data.quantite
     
     db.add(vente)
-    db.commit()
-    db.refresh(vente)
+    db.flush()
+    queries.add_daily_stats(db, boutique.id, vente.date_vente.date(), ventes_total=montant_total, ventes_count=1)
     
-    log_audit(db, boutique.id, "create_sale", "ventes", vente.id, request.client.host,
+    add_audit(db, boutique.id, "create_sale", "ventes", vente.id, request.client.host,
               new_values={"montant": montant_total, "produit": produit.nom})
+    db.commit()
     
     return {
         "vente_id": vente.id,
@@ -427,8 +437,8 @@ async def create_vente(
         "stock_restant": produit.quantite_stock
     }
 
-@app.delete("/api/ventes/{vente_id}")
-async def delete_vente(
+@app.delete("/api/ventes/{vente_id}", response_class=OrjsonResponse)
+def delete_vente(
     vente_id: str,
     request: Request,
     boutique: Boutique = Depends(get_current_boutique),
@@ -443,34 +453,33 @@ async def delete_vente(
     if not vente:
         raise HTTPException(status_code=404, detail="Vente non trouvée")
     
-    produit = db.query(Produit).filter(Produit.id == vente.produit_id).first()
-    if produit:
-        produit.quantite_stock += vente.quantite
+    produit = vente.produit
+    produit.quantite_stock += vente.quantite
     
-    vente.deleted_at = datetime.utcnow()
-    db.commit()
-    
-    log_audit(db, boutique.id, "delete_sale", "ventes", vente.id, request.client.host,
+    vente.deleted_at = utcnow()
+    queries.add_daily_stats(db, boutique.id, vente.date_vente.date(), ventes_total=-vente.montant_total, ventes_count=-1)
+    add_audit(db, boutique.id, "delete_sale", "ventes", vente.id, request.client.host,
               old_values={"montant": vente.montant_total, "quantite": vente.quantite})
+    db.commit()
     
-    return {"success": True, "stock_restaure": produit.quantite_stock if produit else 0}
+    return {"success": True, "stock_restaure": produit.quantite_stock}
 
-@app.get("/api/depenses")
-async def get_depenses(
+@app.get("/api/depenses", response_class=OrjsonResponse)
+def get_depenses(
     limit: int = 20,
     offset: int = 0,
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    depenses = db.query(Depense).filter(
+    depenses = db.query(
+        Depense.id, Depense.categorie, Depense.montant, Depense.description, Depense.date_depense
+    ).filter(
         Depense.boutique_id == boutique.id,
         Depense.deleted_at == None
-    ).order_by(Depense.date_depense.desc()).offset(offset).limit(limit).all()
+    ).order_by(Depense.date_depense.desc()).offset(offset).limit(limit + 1).all()
     
-    total = db.query(func.count(Depense.id)).filter(
-        Depense.boutique_id == boutique.id,
-        Depense.deleted_at == None
-    ).scalar()
+    has_next = len(depenses) > limit
+    depenses = depenses[:limit]
     
     return {
         "depenses": [{
@@ -480,12 +489,18 @@ async def get_depenses(
             "description": d.description,
             "date_depense": d.date_depense.isoformat()
         } for d in depenses],
-        "total": total,
-        "has_next": offset + limit < total
+        "has_next": has_next
     }
 
-@app.post("/api/depenses")
-async def create_depense(
+@app.get("/api/depenses/count", response_class=OrjsonResponse)
+def count_depenses(
+    boutique: Boutique = Depends(get_current_boutique),
+    db: Session = Depends(get_db)
+):
+    return {"total": db.execute(queries.depenses_count, {"boutique_id": boutique.id}).scalar()}
+
+@app.post("/api/depenses", response_class=OrjsonResponse)
+def create_depense(
     request: Request,
     data: DepenseCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -504,32 +519,18 @@ async def create_depense(
     if montant_bucket < 500:
         montant_bucket = 500
     
-    existing_freq = db.query(FrequentDepense).filter(
-        FrequentDepense.boutique_id == boutique.id,
-        FrequentDepense.categorie == data.categorie,
-        FrequentDepense.montant_bucket == montant_bucket
-    ).first()
-    
-    if existing_freq:
-        existing_freq.usage_count += 1
-        existing_freq.last_used_at = datetime.utcnow()
-    else:
-        new_freq = FrequentDepense(
-            boutique_id=boutique.id,
-            categorie=data.categorie,
-            montant_bucket=montant_bucket
-        )
-        db.add(new_freq)
+    db.flush()
+    queries.upsert_frequent_depense(db, boutique.id, data.categorie, montant_bucket)
+    queries.increment_category_usage(db, boutique.id, data.categorie)
+    queries.add_daily_stats(db, boutique.id, depense.date_depense.date(), depenses_total=depense.montant, depenses_count=1)
     
+    add_audit(db, boutique.id, "create_expense", "depenses", depense.id, request.client.host)
     db.commit()
-    db.refresh(depense)
-    
-    log_audit(db, boutique.id, "create_expense", "depenses", depense.id, request.client.host)
     
     return {"id": depense.id, "montant": depense.montant}
 
-@app.delete("/api/depenses/{depense_id}")
-async def delete_depense(
+@app.delete("/api/depenses/{depense_id}", response_class=OrjsonResponse)
+def delete_depense(
     depense_id: str,
     request: Request,
     boutique: Boutique = Depends(get_current_boutique),
@@ -544,16 +545,16 @@ async def delete_depense(
     if not depense:
         raise HTTPException(status_code=404, detail="Dépense non trouvée")
     
-    depense.deleted_at = datetime.utcnow()
-    db.commit()
-    
-    log_audit(db, boutique.id, "delete_expense", "depenses", depense.id, request.client.host,
+    depense.deleted_at = utcnow()
+    queries.add_daily_stats(db, boutique.id, depense.date_depense.date(), depenses_total=-depense.montant, depenses_count=-1)
+    add_audit(db, boutique.id, "delete_expense", "depenses", depense.id, request.client.host,
               old_values={"montant": depense.montant, "categorie": depense.categorie})
+    db.commit()
     
     return {"success": True}
 
-@app.get("/api/depenses/frequentes")
-async def get_frequent_depenses(
+@app.get("/api/depenses/frequentes", response_class=OrjsonResponse)
+def get_frequent_depenses(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
@@ -568,8 +569,8 @@ async def get_frequent_depenses(
         "usage_count": f.usage_count
     } for f in frequentes]
 
-@app.get("/api/depenses/categories")
-async def get_depense_categories(
+@app.get("/api/depenses/categories", response_class=OrjsonResponse)
+def get_depense_categories(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
@@ -586,8 +587,8 @@ async def get_depense_categories(
         "usage_count": c.usage_count
     } for c in categories]
 
-@app.post("/api/depenses/categories")
-async def create_depense_category(
+@app.post("/api/depenses/categories", response_class=OrjsonResponse)
+def create_depense_category(
     request: Request,
     data: DepenseCategoryCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -608,27 +609,29 @@ async def create_depense_category(
         icone=data.icone
     )
     db.add(category)
-    db.commit()
-    db.refresh(category)
+    db.flush()
     
-    log_audit(db, boutique.id, "create_expense_category", "depense_categories", category.id, request.client.host)
+    add_audit(db, boutique.id, "create_expense_category", "depense_categories", category.id, request.client.host)
+    db.commit()
     
     return {"id": category.id, "nom": category.nom, "icone": category.icone}
 
-@app.get("/api/dettes")
-async def get_dettes(
+@app.get("/api/dettes", response_class=OrjsonResponse)
+def get_dettes(
     statut: str = "en_cours",
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    dettes = db.query(Dette).filter(
+    dettes = db.query(
+        Dette.id, Dette.nom_client, Dette.telephone_client, Dette.montant_initial,
+        Dette.montant_restant, Dette.date_creation, Dette.statut,
+        queries.jours_depuis(Dette.date_creation).label("jours")
+    ).filter(
         Dette.boutique_id == boutique.id,
         Dette.statut == statut,
         Dette.deleted_at == None
     ).order_by(Dette.date_creation.asc()).all()
     
-    now = datetime.utcnow()
-    
     return [{
         "id": d.id,
         "nom_client": d.nom_client,
@@ -637,11 +640,11 @@ async def get_dettes(
         "montant_restant": d.montant_restant,
         "date_creation": d.date_creation.isoformat(),
         "statut": d.statut,
-        "jours_depuis_creation": (now - d.date_creation).days
+        "jours_depuis_creation": d.jours
     } for d in dettes]
 
-@app.post("/api/dettes")
-async def create_dette(
+@app.post("/api/dettes", response_class=OrjsonResponse)
+def create_dette(
     request: Request,
     data: DetteCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -655,15 +658,15 @@ async def create_dette(
         montant_restant=data.montant_initial
     )
     db.add(dette)
-    db.commit()
-    db.refresh(dette)
+    db.flush()
     
-    log_audit(db, boutique.id, "create_debt", "dettes", dette.id, request.client.host)
+    add_audit(db, boutique.id, "create_debt", "dettes", dette.id, request.client.host)
+    db.commit()
     
     return {"id": dette.id, "montant": dette.montant_initial}
 
-@app.delete("/api/dettes/{dette_id}")
-async def delete_dette(
+@app.delete("/api/dettes/{dette_id}", response_class=OrjsonResponse)
+def delete_dette(
     dette_id: str,
     request: Request,
     boutique: Boutique = Depends(get_current_boutique),
@@ -678,16 +681,15 @@ async def delete_dette(
     if not dette:
         raise HTTPException(status_code=404, detail="Dette non trouvée")
     
-    dette.deleted_at = datetime.utcnow()
-    db.commit()
-    
-    log_audit(db, boutique.id, "delete_debt", "dettes", dette.id, request.client.host,
+    dette.deleted_at = utcnow()
+    add_audit(db, boutique.id, "delete_debt", "dettes", dette.id, request.client.host,
               old_values={"montant": dette.montant_initial, "client": dette.nom_client})
+    db.commit()
     
     return {"success": True}
 
-@app.post("/api/dettes/{dette_id}/paiement")
-async def payer_dette(
+@app.post("/api/dettes/{dette_id}/paiement", response_class=OrjsonResponse)
+def payer_dette(
     request: Request,
     dette_id: str,
     data: PaiementDetteCreate,
@@ -717,16 +719,29 @@ async def payer_dette(
         dette.statut = 'soldee'
     
     db.add(paiement)
+    add_audit(db, boutique.id, "debt_payment", "dettes", dette.id, request.client.host)
     db.commit()
     
-    log_audit(db, boutique.id, "debt_payment", "dettes", dette.id, request.client.host)
-    
     return {
         "nouveau_solde": dette.montant_restant,
         "statut": dette.statut,
         "paiement_id": paiement.id
     }
 
+def _prepare_voice_parse(db: Session, boutique: Boutique):
+    voice_quota = boutique.features.get("voice_input_quota", 50)
+    
+    voice_count = quota.reserve("voice", boutique.id, voice_quota, lambda since: db.query(func.count(VoiceLog.id)).filter(
+        VoiceLog.boutique_id == boutique.id,
+        VoiceLog.created_at >= since
+    ).scalar())
+    
+    if voice_count is None:
+        return voice_quota, None, None, None
+    
+    produits_list, produits_par_nom = queries.produits_catalogue(db, boutique.id)
+    return voice_quota, voice_count, produits_list, produits_par_nom
+
 @app.post("/api/gemini/parse-voice", response_model=VoiceParseResponse)
 async def parse_voice(
     request: Request,
@@ -734,44 +749,25 @@ async def parse_voice(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    features = json.loads(boutique.features_json)
-    voice_quota = features.get("voice_input_quota", 50)
-    
-    voice_count = db.query(func.count(VoiceLog.id)).filter(
-        VoiceLog.boutique_id == boutique.id,
-        VoiceLog.created_at >= datetime.utcnow().replace(day=1, hour=0, minute=0, second=0)
-    ).scalar()
+    voice_quota, voice_count, produits_list, produits_par_nom = await run_in_threadpool(_prepare_voice_parse, db, boutique)
     
-    if voice_count >= voice_quota:
+    if voice_count is None:
         raise HTTPException(status_code=403, detail="Quota vocal épuisé ce mois-ci")
     
-    produits = db.query(Produit).filter(
-        Produit.boutique_id == boutique.id,
-        Produit.active == True,
-        Produit.deleted_at == None
-    ).all()
+    result = await parse_voice_input(data.transcript, produits_list)
     
-    produits_list = [{"id": p.id, "nom": p.nom, "prix_unitaire": p.prix_unitaire} for p in produits]
-    
-    result = parse_voice_input(data.transcript, produits_list)
-    
-    voice_log = VoiceLog(
-        boutique_id=boutique.id,
-        transcript=data.transcript,
-        parsed_data=json.dumps(result),
-        success=result.get("success", False),
-        error_message=result.get("error"),
-        ip_address=request.client.host
-    )
-    db.add(voice_log)
-    db.commit()
+    log_row(VoiceLog, {
+        "boutique_id": boutique.id,
+        "transcript": data.transcript,
+        "parsed_data": orjson.dumps(result).decode(),
+        "success": result.get("success", False),
+        "error_message": result.get("error"),
+        "ip_address": request.client.host
+    })
     
     produit_match = None
     if result.get("success") and result.get("produit_nom"):
-        for p in produits_list:
-            if p["nom"].lower() == result["produit_nom"].lower():
-                produit_match = p
-                break
+        produit_match = produits_par_nom.get(normalize_nom(result["produit_nom"]))
     
     return VoiceParseResponse(
         success=result.get("success", False),
@@ -779,15 +775,17 @@ async def parse_voice(
         quantite=result.get("quantite"),
         prix_unitaire=result.get("prix_unitaire"),
         confiance=result.get("confiance", 0.0),
-        quota_restant=voice_quota - voice_count - 1
+        quota_restant=voice_quota - voice_count
     )
 
-@app.get("/api/objectifs")
-async def get_objectifs(
+@app.get("/api/objectifs", response_class=OrjsonResponse)
+def get_objectifs(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    objectifs = db.query(Objectif).filter(
+    objectifs = db.query(
+        Objectif.id, Objectif.type, Objectif.montant_cible, Objectif.date_debut, Objectif.date_fin
+    ).filter(
         Objectif.boutique_id == boutique.id,
         Objectif.active == True,
         Objectif.deleted_at == None
@@ -801,8 +799,8 @@ async def get_objectifs(
         "date_fin": o.date_fin.isoformat()
     } for o in objectifs]
 
-@app.post("/api/objectifs")
-async def create_objectif(
+@app.post("/api/objectifs", response_class=OrjsonResponse)
+def create_objectif(
     request: Request,
     data: ObjectifCreate,
     boutique: Boutique = Depends(get_current_boutique),
@@ -820,65 +818,34 @@ async def create_objectif(
     )
     db.add(objectif)
     db.commit()
-    db.refresh(objectif)
     
     return {"id": objectif.id}
 
 CHAT_QUOTA_GRATUIT = 20
+CHAT_ROLE_LABELS = {"user": "Utilisateur"}
 
-@app.post("/api/chat/cecile", response_model=ChatResponse)
-async def chat_cecile(
-    request: Request,
-    data: ChatRequest,
-    boutique: Boutique = Depends(get_current_boutique),
-    db: Session = Depends(get_db)
-):
-    features = json.loads(boutique.features_json)
+def _prepare_cecile_chat(db: Session, boutique: Boutique):
     chat_quota = CHAT_QUOTA_GRATUIT if boutique.plan_type == 'gratuit' else 100
     
-    chat_count = db.query(func.count(ChatMessage.id)).filter(
+    chat_count = quota.reserve("chat", boutique.id, chat_quota, lambda since: db.query(func.count(ChatMessage.id)).filter(
         ChatMessage.boutique_id == boutique.id,
         ChatMessage.role == 'user',
-        ChatMessage.created_at >= datetime.utcnow().replace(day=1, hour=0, minute=0, second=0)
-    ).scalar()
+        ChatMessage.created_at >= since
+    ).scalar())
     
-    if chat_count >= chat_quota:
-        return ChatResponse(
-            success=False,
-            error=f"Quota de messages atteint ({chat_quota}/mois). Passez Premium pour plus de conversations avec Cécile!",
-            quota_restant=0,
-            quota_max=chat_quota
-        )
+    if chat_count is None:
+        return chat_quota, chat_quota, None, None
     
-    history = db.query(ChatMessage).filter(
+    history = db.query(ChatMessage.role, ChatMessage.content).filter(
         ChatMessage.boutique_id == boutique.id
     ).order_by(ChatMessage.created_at.desc()).limit(10).all()
     
-    history_list = [{"role": m.role, "content": m.content} for m in reversed(history)]
-    
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
+    history_list = [{"role": role, "content": content} for role, content in reversed(history)]
     
-    ventes_aujourdhui = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-        Vente.boutique_id == boutique.id,
-        Vente.date_vente >= today_start,
-        Vente.date_vente <= today_end,
-        Vente.deleted_at == None
-    ).scalar()
-    
-    dettes_totales = db.query(func.coalesce(func.sum(Dette.montant_restant), 0)).filter(
-        Dette.boutique_id == boutique.id,
-        Dette.statut == 'en_cours',
-        Dette.deleted_at == None
-    ).scalar()
-    
-    stock_alertes = db.query(func.count(Produit.id)).filter(
-        Produit.boutique_id == boutique.id,
-        Produit.quantite_stock <= Produit.seuil_alerte,
-        Produit.active == True,
-        Produit.deleted_at == None
-    ).scalar()
+    ventes_aujourdhui, dettes_totales, stock_alertes = db.execute(queries.cecile_totaux, {
+        "boutique_id": boutique.id,
+        "jour": utcnow().date()
+    }).one()
     
     context = {
         "nom_boutique": boutique.nom,
@@ -888,40 +855,93 @@ async def chat_cecile(
         "stock_alertes": stock_alertes
     }
     
-    result = chat_with_cecile(data.message, context, history_list)
-    
-    user_msg = ChatMessage(
-        boutique_id=boutique.id,
-        role="user",
-        content=data.message
-    )
-    db.add(user_msg)
+    return chat_quota, chat_count, history_list, context
+
+CECILE_STREAM_ERROR = "Cécile est momentanément indisponible. Réessayez dans un instant."
+
+def _save_chat_messages(boutique_id: str, user_message: str, response: str = None):
+    # L'historique est relu juste après la réponse : écriture synchrone, hors boucle d'événements.
+    messages = [{"boutique_id": boutique_id, "role": "user", "content": user_message}]
+    if response:
+        messages.append({"boutique_id": boutique_id, "role": "assistant", "content": response})
+    with SessionLocal() as db:
+        db.execute(insert(ChatMessage), messages)
+        db.commit()
+
+def _sse_event(data: str, event: str = None) -> str:
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n" if event else f"{lines}\n"
+
+@app.post("/api/chat/cecile", response_model=ChatResponse)
+async def chat_cecile(
+    request: Request,
+    data: ChatRequest,
+    boutique: Boutique = Depends(get_current_boutique),
+    db: Session = Depends(get_db)
+):
+    chat_quota, chat_count, history_list, context = await run_in_threadpool(_prepare_cecile_chat, db, boutique)
     
-    if result.get("success") and result.get("response"):
-        assistant_msg = ChatMessage(
-            boutique_id=boutique.id,
-            role="assistant",
-            content=result["response"]
+    if context is None:
+        return ChatResponse(
+            success=False,
+            error=f"Quota de messages atteint ({chat_quota}/mois). Passez Premium pour plus de conversations avec Cécile!",
+            quota_restant=0,
+            quota_max=chat_quota
         )
-        db.add(assistant_msg)
     
-    db.commit()
+    result = await chat_with_cecile(data.message, context, history_list)
+    
+    response = result.get("response") if result.get("success") else None
+    await run_in_threadpool(_save_chat_messages, boutique.id, data.message, response)
     
     return ChatResponse(
         success=result.get("success", False),
         response=result.get("response"),
         error=result.get("error"),
-        quota_restant=chat_quota - chat_count - 1,
+        quota_restant=chat_quota - chat_count,
         quota_max=chat_quota
     )
 
-@app.get("/api/chat/history")
-async def get_chat_history(
+@app.post("/api/chat/cecile/stream")
+async def chat_cecile_stream(
+    request: Request,
+    data: ChatRequest,
+    boutique: Boutique = Depends(get_current_boutique),
+    db: Session = Depends(get_db)
+):
+    chat_quota, chat_count, history_list, context = await run_in_threadpool(_prepare_cecile_chat, db, boutique)
+    
+    if context is None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Quota de messages atteint ({chat_quota}/mois). Passez Premium pour plus de conversations avec Cécile!"
+        )
+    
+    boutique_id = boutique.id
+    
+    async def event_stream():
+        chunks = []
+        try:
+            async for chunk in stream_chat_with_cecile(data.message, context, history_list):
+                chunks.append(chunk)
+                yield _sse_event(chunk)
+        except Exception:
+            logger.exception("Cécile stream error")
+            yield _sse_event(CECILE_STREAM_ERROR, event="error")
+        
+        await run_in_threadpool(_save_chat_messages, boutique_id, data.message, "".join(chunks).strip())
+        
+        yield _sse_event(str(chat_quota - chat_count), event="done")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/api/chat/history", response_class=OrjsonResponse)
+def get_chat_history(
     limit: int = 20,
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    messages = db.query(ChatMessage).filter(
+    messages = db.query(ChatMessage.role, ChatMessage.content, ChatMessage.created_at).filter(
         ChatMessage.boutique_id == boutique.id
     ).order_by(ChatMessage.created_at.desc()).limit(limit).all()
     
@@ -931,283 +951,309 @@ async def get_chat_history(
         "created_at": m.created_at.isoformat()
     } for m in reversed(messages)]
 
-@app.delete("/api/chat/history")
-async def clear_chat_history(
+@app.delete("/api/chat/history", response_class=OrjsonResponse)
+def clear_chat_history(
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
     db.query(ChatMessage).filter(ChatMessage.boutique_id == boutique.id).delete()
     db.commit()
+    quota.reset("chat", boutique.id)
     return {"success": True}
 
+def _persist_chat_log(boutique_id: str, user_message: str, bot_response: str, success: bool, response_time_ms: int, ip_address: str, auto_tx_recorded: bool = False):
+    # Écriture synchrone, pas via la file d'audit : le quota et la limite de transactions
+    # automatiques comptent ces lignes dès la requête suivante.
+    with SessionLocal() as db:
+        db.execute(insert(ChatLog), [{
+            "boutique_id": boutique_id,
+            "user_message": user_message,
+            "bot_response": bot_response,
+            "success": success,
+            "response_time_ms": response_time_ms,
+            "ip_address": ip_address,
+            "auto_tx_recorded": auto_tx_recorded
+        }])
+        db.commit()
 
-from .schemas import ChatbotRequest
-
-@app.post("/api/chatbot/message")
-async def chatbot_message(
-    request: Request,
-    data: ChatbotRequest,
-    boutique: Boutique = Depends(get_current_boutique),
-    db: Session = Depends(get_db)
-):
-    import time
-    start_time = time.time()
-    
-    features = json.loads(boutique.features_json)
+def _prepare_chatbot_message(db: Session, boutique: Boutique, data: ChatbotRequest):
     chat_quota = CHAT_QUOTA_GRATUIT if boutique.plan_type == 'gratuit' else 100
+    now = utcnow()
     
-    chat_count = db.query(func.count(ChatLog.id)).filter(
+    # Le créneau est réservé avant tout appel Gemini ; chaque branche écrit ensuite son ChatLog.
+    chat_count = quota.reserve("chatbot", boutique.id, chat_quota, lambda since: db.query(func.count(ChatLog.id)).filter(
         ChatLog.boutique_id == boutique.id,
-        ChatLog.created_at >= datetime.utcnow().replace(day=1, hour=0, minute=0, second=0)
-    ).scalar()
-    
-    if chat_count >= chat_quota:
-        return {
-            "response": f"Tu as atteint ton quota de messages ({chat_quota}/mois). Passe Premium pour plus de conversations ! 💎",
-            "suggestions": ["Voir mes ventes", "Gérer mon stock", "Mes dettes"]
-        }
-    
-    today = datetime.utcnow().date()
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-    
-    ventes_aujourdhui = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-        Vente.boutique_id == boutique.id,
-        Vente.date_vente >= today_start,
-        Vente.date_vente <= today_end,
-        Vente.deleted_at == None
-    ).scalar()
-    
-    depenses_aujourdhui = db.query(func.coalesce(func.sum(Depense.montant), 0)).filter(
-        Depense.boutique_id == boutique.id,
-        Depense.date_depense >= today_start,
-        Depense.date_depense <= today_end,
-        Depense.deleted_at == None
-    ).scalar()
-    
-    dettes_totales = db.query(func.coalesce(func.sum(Dette.montant_restant), 0)).filter(
-        Dette.boutique_id == boutique.id,
-        Dette.statut == 'en_cours',
-        Dette.deleted_at == None
-    ).scalar()
-    
-    limite_critique = datetime.utcnow() - timedelta(days=15)
-    dettes_critiques = db.query(func.count(Dette.id)).filter(
-        Dette.boutique_id == boutique.id,
-        Dette.statut == 'en_cours',
-        Dette.date_creation <= limite_critique,
-        Dette.deleted_at == None
-    ).scalar()
-    
-    stock_alertes = db.query(func.count(Produit.id)).filter(
-        Produit.boutique_id == boutique.id,
-        Produit.quantite_stock <= Produit.seuil_alerte,
-        Produit.active == True,
-        Produit.deleted_at == None
-    ).scalar()
-    
-    dettes_liste = db.query(Dette).filter(
+        ChatLog.created_at >= since
+    ).scalar())
+    
+    if chat_count is None:
+        return chat_quota, None, 0, 0, None, None
+    
+    today = now.date()
+    
+    ventes_aujourdhui, depenses_aujourdhui, ventes_semaine, depenses_semaine = db.execute(queries.chatbot_totaux, {
+        "boutique_id": boutique.id,
+        "jour": today,
+        "depuis": today - timedelta(days=7)
+    }).one()
+    
+    # Les totaux sur toutes les dettes en cours viennent de la même requête que la liste
+    dettes_liste = db.query(
+        Dette.nom_client, Dette.montant_restant, Dette.date_creation,
+        func.sum(Dette.montant_restant).over().label("total"),
+        func.count(case((Dette.date_creation <= now - timedelta(days=15), 1))).over().label("critiques")
+    ).filter(
         Dette.boutique_id == boutique.id,
         Dette.statut == 'en_cours',
         Dette.deleted_at == None
     ).order_by(Dette.date_creation.asc()).limit(10).all()
+    dettes_totales = dettes_liste[0].total if dettes_liste else 0
+    dettes_critiques = dettes_liste[0].critiques if dettes_liste else 0
     
-    dettes_str = ""
-    now = datetime.utcnow()
-    for d in dettes_liste:
-        jours = (now - d.date_creation).days
-        dettes_str += f"  - {d.nom_client}: {format_fcfa(d.montant_restant)} (depuis {jours} jours)\n"
+    dettes_str = "".join(
+        f"  - {d.nom_client}: {format_fcfa(d.montant_restant)} (depuis {(now - d.date_creation).days} jours)\n"
+        for d in dettes_liste
+    )
     
-    ventes_recentes = db.query(Vente).filter(
+    ventes_recentes = db.query(Vente).options(selectinload(Vente.produit)).filter(
         Vente.boutique_id == boutique.id,
         Vente.deleted_at == None
     ).order_by(Vente.date_vente.desc()).limit(5).all()
     
-    ventes_str = ""
-    for v in ventes_recentes:
-        ventes_str += f"  - {v.produit.nom}: {v.quantite}x = {format_fcfa(v.montant_total)}\n"
+    ventes_str = "".join(
+        f"  - {v.produit.nom}: {v.quantite}x = {format_fcfa(v.montant_total)}\n"
+        for v in ventes_recentes
+    )
     
-    produits_stock_bas = db.query(Produit).filter(
+    produits_stock_bas = db.query(
+        Produit.nom, Produit.quantite_stock, func.count().over().label("total")
+    ).filter(
         Produit.boutique_id == boutique.id,
         Produit.quantite_stock <= Produit.seuil_alerte,
         Produit.active == True,
         Produit.deleted_at == None
     ).limit(5).all()
+    stock_alertes = produits_stock_bas[0].total if produits_stock_bas else 0
     
-    stock_str = ""
-    for p in produits_stock_bas:
-        stock_str += f"  - {p.nom}: {p.quantite_stock} restant(s)\n"
-    
-    week_start = today - timedelta(days=7)
-    week_start_dt = datetime.combine(week_start, datetime.min.time())
-    ventes_semaine = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-        Vente.boutique_id == boutique.id,
-        Vente.date_vente >= week_start_dt,
-        Vente.deleted_at == None
-    ).scalar()
-    
-    depenses_semaine = db.query(func.coalesce(func.sum(Depense.montant), 0)).filter(
-        Depense.boutique_id == boutique.id,
-        Depense.date_depense >= week_start_dt,
-        Depense.deleted_at == None
-    ).scalar()
+    stock_str = "".join(f"  - {p.nom}: {p.quantite_stock} restant(s)\n" for p in produits_stock_bas)
     
     benefice_semaine = ventes_semaine - depenses_semaine
     
-    context_str = f"""
-CONTEXTE BOUTIQUE :
-- Nom : {boutique.nom}
-- Plan : {boutique.plan_type}
-
-DONNÉES DU JOUR :
-- Ventes aujourd'hui : {format_fcfa(ventes_aujourdhui)}
-- Dépenses aujourd'hui : {format_fcfa(depenses_aujourdhui)}
-- Bénéfice aujourd'hui : {format_fcfa(ventes_aujourdhui - depenses_aujourdhui)}
-
-BILAN DE LA SEMAINE :
-- Ventes 7 jours : {format_fcfa(ventes_semaine)}
-- Dépenses 7 jours : {format_fcfa(depenses_semaine)}
-- Bénéfice net : {format_fcfa(benefice_semaine)}
-
-DETTES EN COURS ({len(dettes_liste)} clients):
-{dettes_str if dettes_str else "  Aucune dette en cours"}
-Total dettes: {format_fcfa(dettes_totales)} ({dettes_critiques} en retard > 15 jours)
-
-VENTES RÉCENTES:
-{ventes_str if ventes_str else "  Aucune vente récente"}
-
-ALERTES STOCK ({stock_alertes} produits):
-{stock_str if stock_str else "  Tout le stock est OK"}
-"""
+    context_str = CHATBOT_CONTEXT_PROMPT.substitute(
+        nom=boutique.nom,
+        plan=boutique.plan_type,
+        ventes_jour=format_fcfa(ventes_aujourdhui),
+        depenses_jour=format_fcfa(depenses_aujourdhui),
+        benefice_jour=format_fcfa(ventes_aujourdhui - depenses_aujourdhui),
+        ventes_semaine=format_fcfa(ventes_semaine),
+        depenses_semaine=format_fcfa(depenses_semaine),
+        benefice_semaine=format_fcfa(benefice_semaine),
+        nb_dettes=len(dettes_liste),
+        dettes=dettes_str or "  Aucune dette en cours",
+        dettes_totales=format_fcfa(dettes_totales),
+        dettes_critiques=dettes_critiques,
+        ventes_recentes=ventes_str or "  Aucune vente récente",
+        stock_alertes=stock_alertes,
+        stock=stock_str or "  Tout le stock est OK"
+    )
     
-    history_str = ""
-    if data.conversation_history:
-        for msg in data.conversation_history[-5:]:
-            role = "Utilisateur" if msg.sender == "user" else "Cécile"
-            history_str += f"{role}: {msg.text}\n"
+    conversation = data.conversation_history or []
+    history_str = "".join(
+        f"{CHAT_ROLE_LABELS.get(msg.sender, 'Cécile')}: {msg.text}\n"
+        for msg in islice(conversation, max(0, len(conversation) - 5), None)
+    )
     
     is_english = data.language == "en"
     
-    if is_english:
-        system_prompt = f"""You are Cécile, an intelligent financial assistant for Djassa Coach, an app for Ivorian merchants.
-
-{context_str}
-
-YOUR ROLE:
-- Help merchants manage their business
-- Respond in simple, accessible English
-- Be friendly, encouraging and proactive
-- Give actionable advice
-- Use emojis sparingly (1-2 max)
-- Offer concrete suggestions
-
-CAPABILITIES:
-- Analyze sales and give insights
-- Advise on debt management
-- Suggest savings
-- Alert on low stock
-- Calculate margins and profits
-- Remind about critical debts
-
-STYLE:
-- Reply briefly (2-3 sentences max unless detailed analysis requested)
-- Be positive and motivating
-- Avoid complex financial jargon
-
-RECENT HISTORY:
-{history_str}
-
-NEW USER MESSAGE:
-{data.message}
-
-INSTRUCTIONS:
-1. Respond naturally and conversationally
-2. If user asks for numbers, use the context stats
-3. If needed, suggest 2-3 quick actions
-4. Maintain an encouraging and professional tone
-
-RESPONSE (JSON format):
-{{
-    "response": "your response here",
-    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
-    "proactive_advice": "optional proactive advice if situation warrants it or null"
-}}"""
-    else:
-        system_prompt = f"""Tu es Cécile, l'assistante financière intelligente de Djassa Coach pour les commerçants ivoiriens.
-
-{context_str}
-
-TON RÔLE :
-- Aide le commerçant à gérer son business
-- Réponds en français simple et accessible
-- Sois amicale, encourageante et proactive
-- Donne des conseils actionnables
-- Utilise des emojis avec parcimonie (1-2 max)
-- Propose des suggestions concrètes
-
-CAPACITÉS :
-- Analyser les ventes et donner des insights
-- Conseiller sur la gestion des dettes
-- Suggérer des économies
-- Alerter sur les stocks bas
-- Calculer des marges et profits
-- Rappeler les dettes critiques
-
-STYLE :
-- Réponds brièvement (2-3 phrases max sauf si analyse demandée)
-- Tutoie l'utilisateur
-- Sois positive et motivante
-- Évite le jargon financier complexe
-
-HISTORIQUE RÉCENT :
-{history_str}
-
-NOUVEAU MESSAGE UTILISATEUR :
-{data.message}
-
-INSTRUCTIONS :
-1. Réponds de manière naturelle et conversationnelle
-2. Si l'utilisateur demande des chiffres, utilise les stats du contexte
-3. Si nécessaire, propose 2-3 suggestions d'actions rapides
-4. Garde un ton encourageant et professionnel
-5. Si les dépenses dépassent les ventes cette semaine, donne un conseil proactif
-
-RÉPONSE (format JSON) :
-{{
-    "response": "ta réponse ici",
-    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
-    "proactive_advice": "conseil proactif optionnel si la situation le justifie ou null"
-}}"""
+    system_prompt = CHATBOT_PROMPTS["en" if is_english else "fr"].substitute(
+        context=context_str,
+        history=history_str,
+        message=data.message
+    )
+    
+    auto_tx_feedback = None
+    produits_for_detection = None
+    
+    if data.auto_record_transactions:
+        five_minutes_ago = now - timedelta(minutes=5)
+        recent_auto_tx_count = db.query(func.count(ChatLog.id)).filter(
+            ChatLog.boutique_id == boutique.id,
+            ChatLog.auto_tx_recorded == True,
+            ChatLog.created_at >= five_minutes_ago
+        ).scalar() or 0
+        
+        if recent_auto_tx_count >= 10:
+            auto_tx_feedback = "Trop de transactions automatiques récentes. Utilisez les formulaires pour continuer." if not is_english else "Too many recent automatic transactions. Please use the forms to continue."
+        else:
+            produits_for_detection = [{
+                "id": p.id,
+                "nom": p.nom,
+                "prix_unitaire": p.prix_unitaire,
+                "quantite_stock": p.quantite_stock
+            } for p in db.query(Produit.id, Produit.nom, Produit.prix_unitaire, Produit.quantite_stock).filter(
+                Produit.boutique_id == boutique.id,
+                Produit.active == True,
+                Produit.deleted_at == None
+            ).limit(30).all()]
+    
+    return chat_quota, system_prompt, ventes_semaine, depenses_semaine, produits_for_detection, auto_tx_feedback
+
+def _record_auto_transaction(db: Session, boutique_id: str, intent: dict, is_english: bool, ip_address: str):
+    # Renvoie (transaction_recorded, réponse à afficher, feedback si rien n'a été enregistré).
+    tx_type = intent.get("transaction_type")
+    details = intent.get("details", {})
+    
+    if tx_type == "vente":
+        produit_nom = details.get("produit_nom")
+        quantite = details.get("quantite")
+        
+        if not (produit_nom and isinstance(produit_nom, str) and len(produit_nom) >= 2):
+            return None, None, "Précisez le produit (ex: 'vendu 3 savons')." if not is_english else "Specify the product (e.g., 'sold 3 soaps')."
+        if not (quantite and isinstance(quantite, (int, float)) and quantite >= 1):
+            return None, None, "Précisez la quantité (ex: '2 sacs de riz')." if not is_english else "Specify the quantity (e.g., '2 bags of rice')."
+        quantite = int(quantite)
+        
+        produit = db.query(Produit).filter(
+            Produit.boutique_id == boutique_id,
+            Produit.nom_normalized.contains(normalize_nom(produit_nom), autoescape=True),
+            Produit.active == True,
+            Produit.deleted_at == None
+        ).first()
+        
+        if not produit:
+            return None, None, f"Produit '{produit_nom}' non trouvé. Ajoutez-le dans le stock d'abord." if not is_english else f"Product '{produit_nom}' not found. Add it to stock first."
+        if produit.quantite_stock < quantite:
+            return None, None, f"Stock insuffisant pour {produit.nom} ({produit.quantite_stock} disponible). Ajoutez du stock d'abord." if not is_english else f"Insufficient stock for {produit.nom} ({produit.quantite_stock} available). Add stock first."
+        
+        montant_total = quantite * produit.prix_unitaire
+        vente = Vente(
+            boutique_id=boutique_id,
+            produit_id=produit.id,
+            quantite=quantite,
+            prix_unitaire=produit.prix_unitaire,
+            montant_total=montant_total
+        )
+        produit.quantite_stock -= quantite
+        db.add(vente)
+        db.flush()
+        queries.add_daily_stats(db, boutique_id, vente.date_vente.date(), ventes_total=montant_total, ventes_count=1)
+        add_audit(db, boutique_id, "create_auto", "ventes", vente.id, ip_address,
+                  new_values={"source": "cecile", "produit": produit.nom, "quantite": quantite})
+        db.commit()
+        
+        tx_msg = f"Vente enregistrée: {quantite}x {produit.nom} = {format_fcfa(montant_total)}" if not is_english else f"Sale recorded: {quantite}x {produit.nom} = {format_fcfa(montant_total)}"
+        return {
+            "type": "vente",
+            "details": {"produit": produit.nom, "quantite": quantite, "montant": montant_total},
+            "success": True,
+            "message": tx_msg
+        }, f"C'est noté ! {tx_msg} 💪" if not is_english else f"Got it! {tx_msg} 💪", None
+    
+    if tx_type == "depense":
+        montant = details.get("montant_total")
+        
+        if not (montant and isinstance(montant, (int, float)) and montant >= 100):
+            return None, None, "Précisez le montant de la dépense (minimum 100 FCFA)." if not is_english else "Specify the expense amount (minimum 100 FCFA)."
+        montant = int(montant)
+        categorie = details.get("categorie") or "Autre"
+        description = details.get("description") or ""
+        
+        if not (isinstance(categorie, str) and len(categorie) >= 2):
+            return None, None, None
+        
+        depense = Depense(
+            boutique_id=boutique_id,
+            categorie=categorie,
+            montant=montant,
+            description=description[:500] if isinstance(description, str) else ""
+        )
+        db.add(depense)
+        db.flush()
+        queries.add_daily_stats(db, boutique_id, depense.date_depense.date(), depenses_total=montant, depenses_count=1)
+        add_audit(db, boutique_id, "create_auto", "depenses", depense.id, ip_address,
+                  new_values={"source": "cecile", "categorie": categorie, "montant": montant})
+        db.commit()
+        
+        tx_msg = f"Dépense enregistrée: {format_fcfa(montant)} ({categorie})" if not is_english else f"Expense recorded: {format_fcfa(montant)} ({categorie})"
+        return {
+            "type": "depense",
+            "details": {"categorie": categorie, "montant": montant},
+            "success": True,
+            "message": tx_msg
+        }, f"C'est noté ! {tx_msg} 📝" if not is_english else f"Got it! {tx_msg} 📝", None
+    
+    if tx_type == "dette":
+        client_nom = details.get("client_nom")
+        montant = details.get("montant_total")
+        
+        if not (client_nom and isinstance(client_nom, str) and len(client_nom) >= 2):
+            return None, None, "Précisez le nom du client." if not is_english else "Specify the client's name."
+        if not (montant and isinstance(montant, (int, float)) and montant >= 500):
+            return None, None, "Précisez le montant de la dette (minimum 500 FCFA)." if not is_english else "Specify the debt amount (minimum 500 FCFA)."
+        montant = int(montant)
+        
+        dette = Dette(
+            boutique_id=boutique_id,
+            nom_client=client_nom[:100],
+            montant_initial=montant,
+            montant_restant=montant
+        )
+        db.add(dette)
+        db.flush()
+        add_audit(db, boutique_id, "create_auto", "dettes", dette.id, ip_address,
+                  new_values={"source": "cecile", "client": client_nom, "montant": montant})
+        db.commit()
+        
+        tx_msg = f"Dette enregistrée: {client_nom} doit {format_fcfa(montant)}" if not is_english else f"Debt recorded: {client_nom} owes {format_fcfa(montant)}"
+        return {
+            "type": "dette",
+            "details": {"client": client_nom, "montant": montant},
+            "success": True,
+            "message": tx_msg
+        }, f"C'est noté ! {tx_msg} 📋" if not is_english else f"Got it! {tx_msg} 📋", None
+    
+    return None, None, None
 
+@app.post("/api/chatbot/message", response_class=OrjsonResponse)
+async def chatbot_message(
+    request: Request,
+    data: ChatbotRequest,
+    boutique: Boutique = Depends(get_current_boutique),
+    db: Session = Depends(get_db)
+):
+    start_time = time.time()
+    is_english = data.language == "en"
+    
+    # Toutes les requêtes SQL passent par le threadpool ; seuls les appels Gemini restent sur la boucle.
+    chat_quota, system_prompt, ventes_semaine, depenses_semaine, produits_for_detection, auto_tx_feedback = await run_in_threadpool(
+        _prepare_chatbot_message, db, boutique, data
+    )
+    
+    if system_prompt is None:
+        return {
+            "response": f"Tu as atteint ton quota de messages ({chat_quota}/mois). Passe Premium pour plus de conversations ! 💎",
+            "suggestions": ["Voir mes ventes", "Gérer mon stock", "Mes dettes"]
+        }
+    
     try:
-        from .gemini_service import get_client
-        import re
-        
         client = get_client()
         if not client:
             response_time_ms = int((time.time() - start_time) * 1000)
-            chat_log = ChatLog(
-                boutique_id=boutique.id,
-                user_message=data.message,
-                bot_response="API non configurée",
-                success=False,
-                response_time_ms=response_time_ms,
-                ip_address=request.client.host
-            )
-            db.add(chat_log)
-            db.commit()
+            await run_in_threadpool(_persist_chat_log, boutique.id, data.message, "API non configurée", False, response_time_ms, request.client.host)
             
             return {
                 "response": "Désolée, je rencontre un problème technique. Vérifie la configuration de l'API ! 🙏",
                 "suggestions": ["Mes ventes aujourd'hui", "Conseils pour économiser", "Mes dettes en retard"]
             }
         
-        gemini_response = client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=system_prompt
-        )
-        
-        text = (gemini_response.text or "").strip()
+        # Pas de cache quand le message peut enregistrer une transaction
+        reply = generate_chatbot_response(system_prompt, use_cache=not data.auto_record_transactions)
+        if produits_for_detection is not None:
+            # La réponse et la détection d'intention partent en parallèle
+            text, intent = await asyncio.gather(reply, detect_transaction_intent(data.message, produits_for_detection, data.language))
+        else:
+            text, intent = await reply, None
+        text = text.strip()
         
         if text.startswith("```json"):
             text = text[7:]
@@ -1216,9 +1262,9 @@ RÉPONSE (format JSON) :
         if text.endswith("```"):
             text = text[:-3]
         
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
+        json_start, json_end = text.find("{"), text.rfind("}")
+        if json_start != -1 and json_end > json_start:
+            result = orjson.loads(text[json_start:json_end + 1])
         else:
             result = {
                 "response": text,
@@ -1226,148 +1272,16 @@ RÉPONSE (format JSON) :
             }
         
         transaction_recorded = None
-        auto_tx_feedback = None
         
-        if data.auto_record_transactions:
-            five_minutes_ago = datetime.utcnow() - timedelta(minutes=5)
-            recent_auto_tx_count = db.query(func.count(ChatLog.id)).filter(
-                ChatLog.boutique_id == boutique.id,
-                ChatLog.created_at >= five_minutes_ago,
-                ChatLog.bot_response.like("%enregistrée:%") | ChatLog.bot_response.like("%recorded:%")
-            ).scalar() or 0
-            
-            if recent_auto_tx_count >= 10:
-                auto_tx_feedback = "Trop de transactions automatiques récentes. Utilisez les formulaires pour continuer." if not is_english else "Too many recent automatic transactions. Please use the forms to continue."
-            else:
-                produits_for_detection = [{
-                    "id": p.id,
-                    "nom": p.nom,
-                    "prix_unitaire": p.prix_unitaire,
-                    "quantite_stock": p.quantite_stock
-                } for p in db.query(Produit).filter(
-                    Produit.boutique_id == boutique.id,
-                    Produit.active == True,
-                    Produit.deleted_at == None
-                ).limit(30).all()]
-                
-                intent = detect_transaction_intent(data.message, produits_for_detection, data.language)
-                
-                if intent.get("has_transaction") and intent.get("confidence", 0) >= 0.8:
-                    tx_type = intent.get("transaction_type")
-                    details = intent.get("details", {})
-                    
-                    if tx_type == "vente":
-                        produit_nom = details.get("produit_nom")
-                        quantite = details.get("quantite")
-                        
-                        if produit_nom and isinstance(produit_nom, str) and len(produit_nom) >= 2:
-                            if quantite and isinstance(quantite, (int, float)) and quantite >= 1:
-                                quantite = int(quantite)
-                                
-                                produit = db.query(Produit).filter(
-                                    Produit.boutique_id == boutique.id,
-                                    func.lower(Produit.nom).like(f"%{produit_nom.lower()}%"),
-                                    Produit.active == True,
-                                    Produit.deleted_at == None
-                                ).first()
-                                
-                                if produit and produit.quantite_stock >= quantite:
-                                    montant_total = quantite * produit.prix_unitaire
-                                    vente = Vente(
-                                        boutique_id=boutique.id,
-                                        produit_id=produit.id,
-                                        quantite=quantite,
-                                        prix_unitaire=produit.prix_unitaire,
-                                        montant_total=montant_total
-                                    )
-                                    produit.quantite_stock -= quantite
-                                    db.add(vente)
-                                    db.commit()
-                                    
-                                    log_audit(db, boutique.id, "create_auto", "ventes", str(vente.id), request.client.host, None, {"source": "cecile", "produit": produit.nom, "quantite": quantite})
-                                    
-                                    tx_msg = f"Vente enregistrée: {quantite}x {produit.nom} = {format_fcfa(montant_total)}" if not is_english else f"Sale recorded: {quantite}x {produit.nom} = {format_fcfa(montant_total)}"
-                                    transaction_recorded = {
-                                        "type": "vente",
-                                        "details": {"produit": produit.nom, "quantite": quantite, "montant": montant_total},
-                                        "success": True,
-                                        "message": tx_msg
-                                    }
-                                    result["response"] = f"C'est noté ! {tx_msg} 💪" if not is_english else f"Got it! {tx_msg} 💪"
-                                elif produit and produit.quantite_stock < quantite:
-                                    auto_tx_feedback = f"Stock insuffisant pour {produit.nom} ({produit.quantite_stock} disponible). Ajoutez du stock d'abord." if not is_english else f"Insufficient stock for {produit.nom} ({produit.quantite_stock} available). Add stock first."
-                                elif not produit:
-                                    auto_tx_feedback = f"Produit '{produit_nom}' non trouvé. Ajoutez-le dans le stock d'abord." if not is_english else f"Product '{produit_nom}' not found. Add it to stock first."
-                            else:
-                                auto_tx_feedback = "Précisez la quantité (ex: '2 sacs de riz')." if not is_english else "Specify the quantity (e.g., '2 bags of rice')."
-                        else:
-                            auto_tx_feedback = "Précisez le produit (ex: 'vendu 3 savons')." if not is_english else "Specify the product (e.g., 'sold 3 soaps')."
-                    
-                    elif tx_type == "depense":
-                        montant = details.get("montant_total")
-                        
-                        if montant and isinstance(montant, (int, float)) and montant >= 100:
-                            montant = int(montant)
-                            categorie = details.get("categorie") or "Autre"
-                            description = details.get("description") or ""
-                            
-                            if isinstance(categorie, str) and len(categorie) >= 2:
-                                depense = Depense(
-                                    boutique_id=boutique.id,
-                                    categorie=categorie,
-                                    montant=montant,
-                                    description=description[:500] if isinstance(description, str) else ""
-                                )
-                                db.add(depense)
-                                db.commit()
-                                
-                                log_audit(db, boutique.id, "create_auto", "depenses", str(depense.id), request.client.host, None, {"source": "cecile", "categorie": categorie, "montant": montant})
-                                
-                                tx_msg = f"Dépense enregistrée: {format_fcfa(montant)} ({categorie})" if not is_english else f"Expense recorded: {format_fcfa(montant)} ({categorie})"
-                                transaction_recorded = {
-                                    "type": "depense",
-                                    "details": {"categorie": categorie, "montant": montant},
-                                    "success": True,
-                                    "message": tx_msg
-                                }
-                                result["response"] = f"C'est noté ! {tx_msg} 📝" if not is_english else f"Got it! {tx_msg} 📝"
-                        else:
-                            auto_tx_feedback = "Précisez le montant de la dépense (minimum 100 FCFA)." if not is_english else "Specify the expense amount (minimum 100 FCFA)."
-                    
-                    elif tx_type == "dette":
-                        client_nom = details.get("client_nom")
-                        montant = details.get("montant_total")
-                        
-                        if client_nom and isinstance(client_nom, str) and len(client_nom) >= 2:
-                            if montant and isinstance(montant, (int, float)) and montant >= 500:
-                                montant = int(montant)
-                                
-                                dette = Dette(
-                                    boutique_id=boutique.id,
-                                    nom_client=client_nom[:100],
-                                    montant_initial=montant,
-                                    montant_restant=montant
-                                )
-                                db.add(dette)
-                                db.commit()
-                                
-                                log_audit(db, boutique.id, "create_auto", "dettes", str(dette.id), request.client.host, None, {"source": "cecile", "client": client_nom, "montant": montant})
-                                
-                                tx_msg = f"Dette enregistrée: {client_nom} doit {format_fcfa(montant)}" if not is_english else f"Debt recorded: {client_nom} owes {format_fcfa(montant)}"
-                                transaction_recorded = {
-                                    "type": "dette",
-                                    "details": {"client": client_nom, "montant": montant},
-                                    "success": True,
-                                    "message": tx_msg
-                                }
-                                result["response"] = f"C'est noté ! {tx_msg} 📋" if not is_english else f"Got it! {tx_msg} 📋"
-                            else:
-                                auto_tx_feedback = "Précisez le montant de la dette (minimum 500 FCFA)." if not is_english else "Specify the debt amount (minimum 500 FCFA)."
-                        else:
-                            auto_tx_feedback = "Précisez le nom du client." if not is_english else "Specify the client's name."
-        
-        if transaction_recorded:
-            result["transaction_recorded"] = transaction_recorded
+        if intent and intent.get("has_transaction") and intent.get("confidence", 0) >= 0.8:
+            transaction_recorded, tx_response, tx_feedback = await run_in_threadpool(
+                _record_auto_transaction, db, boutique.id, intent, is_english, request.client.host
+            )
+            if transaction_recorded:
+                result["response"] = tx_response
+                result["transaction_recorded"] = transaction_recorded
+            elif tx_feedback:
+                auto_tx_feedback = tx_feedback
         
         if auto_tx_feedback and not transaction_recorded:
             if result.get("response"):
@@ -1385,32 +1299,14 @@ RÉPONSE (format JSON) :
         
         response_time_ms = int((time.time() - start_time) * 1000)
         
-        chat_log = ChatLog(
-            boutique_id=boutique.id,
-            user_message=data.message,
-            bot_response=result.get("response", ""),
-            success=True,
-            response_time_ms=response_time_ms,
-            ip_address=request.client.host
-        )
-        db.add(chat_log)
-        db.commit()
+        await run_in_threadpool(_persist_chat_log, boutique.id, data.message, result.get("response", ""), True, response_time_ms, request.client.host, transaction_recorded is not None)
         
         return result
         
-    except json.JSONDecodeError as json_err:
+    except orjson.JSONDecodeError as json_err:
         response_time_ms = int((time.time() - start_time) * 1000)
         fallback_response = "Désolée, j'ai rencontré un problème technique. Pouvez-vous reformuler votre question ? 🙏"
-        chat_log = ChatLog(
-            boutique_id=boutique.id,
-            user_message=data.message,
-            bot_response=f"Erreur JSON: {str(json_err)}",
-            success=False,
-            response_time_ms=response_time_ms,
-            ip_address=request.client.host
-        )
-        db.add(chat_log)
-        db.commit()
+        await run_in_threadpool(_persist_chat_log, boutique.id, data.message, f"Erreur JSON: {str(json_err)}", False, response_time_ms, request.client.host)
         
         return {
             "response": fallback_response,
@@ -1418,16 +1314,7 @@ RÉPONSE (format JSON) :
         }
     except Exception as e:
         response_time_ms = int((time.time() - start_time) * 1000)
-        chat_log = ChatLog(
-            boutique_id=boutique.id,
-            user_message=data.message,
-            bot_response=str(e),
-            success=False,
-            response_time_ms=response_time_ms,
-            ip_address=request.client.host
-        )
-        db.add(chat_log)
-        db.commit()
+        await run_in_threadpool(_persist_chat_log, boutique.id, data.message, str(e), False, response_time_ms, request.client.host)
         
         return {
             "response": "Désolée, j'ai rencontré un problème technique. Pouvez-vous réessayer ? 🙏",
@@ -1435,13 +1322,13 @@ RÉPONSE (format JSON) :
         }
 
 
-@app.get("/api/reports/net-profit")
-async def get_net_profit(
+@app.get("/api/reports/net-profit", response_class=OrjsonResponse)
+def get_net_profit(
     periode: str = "jour",
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    today = date.today()
+    today = utcnow().date()
     days = 7 if periode in ["jour", "semaine"] else 14
     start_date = today - timedelta(days=days)
     start_dt = datetime.combine(start_date, datetime.min.time())
@@ -1465,15 +1352,15 @@ async def get_net_profit(
     }
 
 
-@app.get("/api/reports/{report_type}")
-async def get_reports(
+@app.get("/api/reports/{report_type}", response_class=OrjsonResponse)
+def get_reports(
     report_type: str,
     periode: str = "jour",
     date_debut: str = None,
     boutique: Boutique = Depends(get_current_boutique),
     db: Session = Depends(get_db)
 ):
-    today = date.today()
+    today = utcnow().date()
     
     if date_debut:
         try:
@@ -1488,59 +1375,33 @@ async def get_reports(
     report_data = []
     total = 0
     
-    if report_type == "ventes":
-        for i in range(days):
-            current_date = start_date - timedelta(days=i)
-            date_start = datetime.combine(current_date, datetime.min.time())
-            date_end = datetime.combine(current_date, datetime.max.time())
-            
-            montant = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-                Vente.boutique_id == boutique.id,
-                Vente.date_vente >= date_start,
-                Vente.date_vente <= date_end,
-                Vente.deleted_at == None
-            ).scalar()
-            
-            count = db.query(func.count(Vente.id)).filter(
-                Vente.boutique_id == boutique.id,
-                Vente.date_vente >= date_start,
-                Vente.date_vente <= date_end,
-                Vente.deleted_at == None
-            ).scalar()
-            
-            report_data.append({
-                "date": current_date.isoformat(),
-                "montantTotal": int(montant),
-                "nombreTransactions": count
-            })
-            total += int(montant)
+    prev_start = start_date - timedelta(days=days)
+    prev_total = 0
     
-    elif report_type == "depenses":
+    if report_type in ("ventes", "depenses"):
+        if report_type == "ventes":
+            montant_col, count_col = DailyBoutiqueStats.ventes_total, DailyBoutiqueStats.ventes_count
+        else:
+            montant_col, count_col = DailyBoutiqueStats.depenses_total, DailyBoutiqueStats.depenses_count
+        
+        # Période courante et période précédente en une seule requête
+        lignes = db.query(DailyBoutiqueStats.jour, montant_col, count_col).filter(
+            DailyBoutiqueStats.boutique_id == boutique.id,
+            DailyBoutiqueStats.jour >= prev_start - timedelta(days=days - 1),
+            DailyBoutiqueStats.jour <= start_date
+        ).all()
+        par_jour = {j.isoformat(): (montant, count) for j, montant, count in lignes}
+        
         for i in range(days):
             current_date = start_date - timedelta(days=i)
-            date_start = datetime.combine(current_date, datetime.min.time())
-            date_end = datetime.combine(current_date, datetime.max.time())
-            
-            montant = db.query(func.coalesce(func.sum(Depense.montant), 0)).filter(
-                Depense.boutique_id == boutique.id,
-                Depense.date_depense >= date_start,
-                Depense.date_depense <= date_end,
-                Depense.deleted_at == None
-            ).scalar()
-            
-            count = db.query(func.count(Depense.id)).filter(
-                Depense.boutique_id == boutique.id,
-                Depense.date_depense >= date_start,
-                Depense.date_depense <= date_end,
-                Depense.deleted_at == None
-            ).scalar()
-            
+            montant, count = par_jour.get(current_date.isoformat(), (0, 0))
             report_data.append({
                 "date": current_date.isoformat(),
-                "montantTotal": int(montant),
+                "montantTotal": montant,
                 "nombreTransactions": count
             })
-            total += int(montant)
+            total += montant
+            prev_total += par_jour.get((prev_start - timedelta(days=i)).isoformat(), (0, 0))[0]
     
     elif report_type == "dettes":
         dettes = db.query(Dette).filter(
@@ -1577,34 +1438,6 @@ async def get_reports(
     
     average = total / days if days > 0 else 0
     
-    prev_start = start_date - timedelta(days=days)
-    prev_total = 0
-    
-    if report_type == "ventes":
-        for i in range(days):
-            current_date = prev_start - timedelta(days=i)
-            date_start = datetime.combine(current_date, datetime.min.time())
-            date_end = datetime.combine(current_date, datetime.max.time())
-            montant = db.query(func.coalesce(func.sum(Vente.montant_total), 0)).filter(
-                Vente.boutique_id == boutique.id,
-                Vente.date_vente >= date_start,
-                Vente.date_vente <= date_end,
-                Vente.deleted_at == None
-            ).scalar()
-            prev_total += int(montant)
-    elif report_type == "depenses":
-        for i in range(days):
-            current_date = prev_start - timedelta(days=i)
-            date_start = datetime.combine(current_date, datetime.min.time())
-            date_end = datetime.combine(current_date, datetime.max.time())
-            montant = db.query(func.coalesce(func.sum(Depense.montant), 0)).filter(
-                Depense.boutique_id == boutique.id,
-                Depense.date_depense >= date_start,
-                Depense.date_depense <= date_end,
-                Depense.deleted_at == None
-            ).scalar()
-            prev_total += int(montant)
-    
     trend = 0
     if prev_total > 0:
         trend = round(((total - prev_total) / prev_total) * 100)
@@ -1618,13 +1451,15 @@ async def get_reports(
         }
     }
 
+class SPAStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            if e.status_code != 404:
+                raise
+            return await super().get_response("index.html", scope)
+
 static_path = os.path.join(os.path.dirname(__file__), "../../frontend/dist")
 if os.path.exists(static_path):
-    app.mount("/assets", StaticFiles(directory=os.path.join(static_path, "assets")), name="assets")
-    
-    @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
-        file_path = os.path.join(static_path, full_path)
-        if os.path.isfile(file_path):
-            return FileResponse(file_path)
-        return FileResponse(os.path.join(static_path, "index.html"))
+    app.mount("/", SPAStaticFiles(directory=static_path, html=True), name="spa")
@@ -0,0 +1,66 @@
+import logging
+
+from sqlalchemy import func, inspect, text
+
+from .database import SessionLocal, engine, init_db
+from . import queries
+from .models import DailyBoutiqueStats, FrequentDepense, Produit, Vente, normalize_nom
+
+logger = logging.getLogger(__name__)
+
+def merge_frequent_depense_duplicates(db):
+    # L'ancien select-then-insert a pu créer plusieurs lignes pour un même bucket :
+    # on les fusionne (compteurs additionnés) avant de poser l'index unique.
+    cle = (FrequentDepense.boutique_id, FrequentDepense.categorie, FrequentDepense.montant_bucket)
+    doublons = db.query(*cle).group_by(*cle).having(func.count(FrequentDepense.id) > 1).all()
+    for boutique_id, categorie, montant_bucket in doublons:
+        gardee, *autres = db.query(FrequentDepense).filter(
+            FrequentDepense.boutique_id == boutique_id,
+            FrequentDepense.categorie == categorie,
+            FrequentDepense.montant_bucket == montant_bucket
+        ).order_by(FrequentDepense.created_at).all()
+        lignes = [gardee, *autres]
+        gardee.usage_count = sum(l.usage_count or 0 for l in lignes)
+        gardee.last_used_at = max((l.last_used_at for l in lignes if l.last_used_at), default=gardee.last_used_at)
+        for ligne in autres:
+            db.delete(ligne)
+    db.commit()
+
+def convert_hex_token_hashes(db):
+    # Anciennes sessions : sha256 en hexadécimal (64 caractères) au lieu des 32 octets bruts.
+    # Les lignes déjà converties font 32 octets et ne sont plus sélectionnées.
+    anciennes = db.execute(text("SELECT id, token_hash FROM sessions WHERE length(token_hash) = 64")).all()
+    for session_id, token_hash in anciennes:
+        if isinstance(token_hash, str):
+            db.execute(
+                text("UPDATE sessions SET token_hash = :token_hash WHERE id = :id AND token_hash = :ancien"),
+                {"token_hash": bytes.fromhex(token_hash), "id": session_id, "ancien": token_hash}
+            )
+
+def report_inconsistent_ventes(db) -> int:
+    # ck_ventes_montant_total ne s'applique qu'aux bases neuves : on signale les anciennes
+    # lignes qui la violent sans toucher aux montants encaissés.
+    ids = [vente_id for vente_id, in db.query(Vente.id).filter(
+        Vente.montant_total != Vente.quantite * Vente.prix_unitaire
+    )]
+    if ids:
+        logger.warning("%d vente(s) avec montant_total != quantite * prix_unitaire : %s", len(ids), ", ".join(ids[:20]))
+    return len(ids)
+
+def migrate():
+    if inspect(engine).has_table(FrequentDepense.__tablename__):
+        with SessionLocal() as db:
+            merge_frequent_depense_duplicates(db)
+    init_db()
+    with SessionLocal() as db:
+        # Remplit les agrégats journaliers pour une base créée avant cette table
+        if db.query(DailyBoutiqueStats).first() is None:
+            queries.rebuild_daily_stats(db)
+        for produit in db.query(Produit).filter(Produit.nom_normalized == None):
+            produit.nom_normalized = normalize_nom(produit.nom)
+        convert_hex_token_hashes(db)
+        report_inconsistent_ventes(db)
+        db.commit()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,12 +1,26 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, CheckConstraint, Index
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy import event, Column, String, Integer, Boolean, Date, DateTime, Text, ForeignKey, CheckConstraint, Index, LargeBinary, text, false
+from sqlalchemy.orm import relationship, validates
+from datetime import datetime, timezone
+from functools import lru_cache
+import orjson
+import unicodedata
 import uuid
 
 from .database import Base
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 def generate_uuid():
-    return str(uuid.uuid4()).replace('-', '')
+    return uuid.uuid4().hex
+
+def normalize_nom(nom: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", nom)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+@lru_cache(maxsize=2048)
+def parse_features(features_json: str) -> dict:
+    return orjson.loads(features_json) if features_json else {}
 
 class Boutique(Base):
     __tablename__ = "boutiques"
@@ -15,7 +29,6 @@ class Boutique(Base):
     nom = Column(String(100), nullable=False)
     telephone = Column(String(20), unique=True, nullable=False)
     pin_hash = Column(String(128), nullable=False)
-    pin_salt = Column(String(64), nullable=False)
     failed_login_attempts = Column(Integer, default=0)
     locked_until = Column(DateTime, nullable=True)
     plan_type = Column(String(20), default='gratuit')
@@ -26,16 +39,20 @@ class Boutique(Base):
     last_login_ip = Column(String(50), nullable=True)
     active = Column(Boolean, default=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     
-    produits = relationship("Produit", back_populates="boutique", cascade="all, delete-orphan")
-    ventes = relationship("Vente", back_populates="boutique", cascade="all, delete-orphan")
-    depenses = relationship("Depense", back_populates="boutique", cascade="all, delete-orphan")
-    dettes = relationship("Dette", back_populates="boutique", cascade="all, delete-orphan")
-    objectifs = relationship("Objectif", back_populates="boutique", cascade="all, delete-orphan")
-    voice_logs = relationship("VoiceLog", back_populates="boutique", cascade="all, delete-orphan")
-    sessions = relationship("Session", back_populates="boutique", cascade="all, delete-orphan")
+    produits = relationship("Produit", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    ventes = relationship("Vente", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    depenses = relationship("Depense", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    dettes = relationship("Dette", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    objectifs = relationship("Objectif", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    voice_logs = relationship("VoiceLog", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    sessions = relationship("Session", back_populates="boutique", cascade="all, delete-orphan", lazy="write_only", passive_deletes=True)
+    
+    @property
+    def features(self) -> dict:
+        return parse_features(self.features_json)
 
 class Produit(Base):
     __tablename__ = "produits"
@@ -43,6 +60,7 @@ class Produit(Base):
     id = Column(String(32), primary_key=True, default=generate_uuid)
     boutique_id = Column(String(32), ForeignKey("boutiques.id", ondelete="CASCADE"), nullable=False)
     nom = Column(String(100), nullable=False)
+    nom_normalized = Column(String(100), nullable=True)
     prix_unitaire = Column(Integer, nullable=False)
     quantite_stock = Column(Integer, default=0)
     seuil_alerte = Column(Integer, default=5)
@@ -50,11 +68,22 @@ class Produit(Base):
     code_barre = Column(String(100), unique=True, nullable=True)
     active = Column(Boolean, default=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     
     boutique = relationship("Boutique", back_populates="produits")
-    ventes = relationship("Vente", back_populates="produit")
+    ventes = relationship("Vente", back_populates="produit", lazy="write_only", passive_deletes="all")
+    
+    __table_args__ = (
+        Index('idx_produits_boutique_active', 'boutique_id', 'active', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_produits_boutique_nom', 'boutique_id', 'nom_normalized', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_produits_stock_bas', 'boutique_id', sqlite_where=text("quantite_stock <= seuil_alerte AND deleted_at IS NULL"), postgresql_where=text("quantite_stock <= seuil_alerte AND deleted_at IS NULL")),
+    )
+    
+    @validates("nom")
+    def _set_nom_normalized(self, key, nom):
+        self.nom_normalized = normalize_nom(nom) if nom else None
+        return nom
 
 class Vente(Base):
     __tablename__ = "ventes"
@@ -67,14 +96,26 @@ class Vente(Base):
     montant_total = Column(Integer, nullable=False)
     mode_paiement = Column(String(20), default='especes')
     reference_paiement = Column(String(100), nullable=True)
-    date_vente = Column(DateTime, default=datetime.utcnow)
+    date_vente = Column(DateTime, default=utcnow)
     synced = Column(Boolean, default=False)
     ip_address = Column(String(50), nullable=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     boutique = relationship("Boutique", back_populates="ventes")
-    produit = relationship("Produit", back_populates="ventes")
+    produit = relationship("Produit", back_populates="ventes", lazy="joined", innerjoin=True)
+    
+    __table_args__ = (
+        Index('idx_ventes_boutique_date', 'boutique_id', 'date_vente', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+        Index('idx_ventes_produit', 'produit_id'),
+        CheckConstraint('montant_total = quantite * prix_unitaire', name='ck_ventes_montant_total'),
+    )
+
+@event.listens_for(Vente, "before_insert")
+def _check_montant_total(mapper, connection, target):
+    # Même règle que ck_ventes_montant_total, aussi pour les bases créées avant la contrainte.
+    if target.montant_total != target.quantite * target.prix_unitaire:
+        raise ValueError("montant_total doit être égal à quantite * prix_unitaire")
 
 class Depense(Base):
     __tablename__ = "depenses"
@@ -85,13 +126,17 @@ class Depense(Base):
     montant = Column(Integer, nullable=False)
     description = Column(Text, nullable=True)
     recu_url = Column(String(500), nullable=True)
-    date_depense = Column(DateTime, default=datetime.utcnow)
+    date_depense = Column(DateTime, default=utcnow)
     synced = Column(Boolean, default=False)
     ip_address = Column(String(50), nullable=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     boutique = relationship("Boutique", back_populates="depenses")
+    
+    __table_args__ = (
+        Index('idx_depenses_boutique_date', 'boutique_id', 'date_depense', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+    )
 
 class Dette(Base):
     __tablename__ = "dettes"
@@ -102,17 +147,21 @@ class Dette(Base):
     telephone_client = Column(String(20), nullable=True)
     montant_initial = Column(Integer, nullable=False)
     montant_restant = Column(Integer, nullable=False)
-    date_creation = Column(DateTime, default=datetime.utcnow)
+    date_creation = Column(DateTime, default=utcnow)
     date_echeance = Column(DateTime, nullable=True)
     statut = Column(String(20), default='en_cours')
     rappels_envoyes = Column(Integer, default=0)
     synced = Column(Boolean, default=False)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
     
     boutique = relationship("Boutique", back_populates="dettes")
     paiements = relationship("PaiementDette", back_populates="dette", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index('idx_dettes_boutique_statut_date', 'boutique_id', 'statut', 'date_creation', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+    )
 
 class PaiementDette(Base):
     __tablename__ = "paiements_dettes"
@@ -122,11 +171,15 @@ class PaiementDette(Base):
     montant_paye = Column(Integer, nullable=False)
     mode_paiement = Column(String(20), default='especes')
     reference_paiement = Column(String(100), nullable=True)
-    date_paiement = Column(DateTime, default=datetime.utcnow)
+    date_paiement = Column(DateTime, default=utcnow)
     ip_address = Column(String(50), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     dette = relationship("Dette", back_populates="paiements")
+    
+    __table_args__ = (
+        Index('idx_paiements_dettes_dette', 'dette_id'),
+    )
 
 class Objectif(Base):
     __tablename__ = "objectifs"
@@ -139,9 +192,13 @@ class Objectif(Base):
     date_fin = Column(DateTime, nullable=False)
     active = Column(Boolean, default=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     boutique = relationship("Boutique", back_populates="objectifs")
+    
+    __table_args__ = (
+        Index('idx_objectifs_boutique_active', 'boutique_id', 'active', sqlite_where=text("deleted_at IS NULL"), postgresql_where=text("deleted_at IS NULL")),
+    )
 
 class VoiceLog(Base):
     __tablename__ = "voice_logs"
@@ -154,7 +211,7 @@ class VoiceLog(Base):
     error_message = Column(Text, nullable=True)
     duration_ms = Column(Integer, nullable=True)
     ip_address = Column(String(50), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     boutique = relationship("Boutique", back_populates="voice_logs")
 
@@ -163,14 +220,18 @@ class Session(Base):
     
     id = Column(String(32), primary_key=True, default=generate_uuid)
     boutique_id = Column(String(32), ForeignKey("boutiques.id", ondelete="CASCADE"), nullable=False)
-    token_hash = Column(String(256), unique=True, nullable=False)
+    token_hash = Column(LargeBinary(32), unique=True, nullable=False)
     ip_address = Column(String(50), nullable=False)
     user_agent = Column(Text, nullable=True)
     expires_at = Column(DateTime, nullable=False)
     revoked = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     boutique = relationship("Boutique", back_populates="sessions")
+    
+    __table_args__ = (
+        Index('idx_sessions_boutique_expires', 'boutique_id', 'expires_at'),
+    )
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
@@ -184,7 +245,11 @@ class AuditLog(Base):
     new_values = Column(Text, nullable=True)
     ip_address = Column(String(50), nullable=False)
     user_agent = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    
+    __table_args__ = (
+        Index('idx_audit_logs_boutique', 'boutique_id', 'created_at'),
+    )
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -193,7 +258,11 @@ class ChatMessage(Base):
     boutique_id = Column(String(32), ForeignKey("boutiques.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+    
+    __table_args__ = (
+        Index('idx_chat_messages_boutique', 'boutique_id', 'created_at'),
+    )
 
 class ChatLog(Base):
     __tablename__ = "chat_logs"
@@ -205,10 +274,12 @@ class ChatLog(Base):
     success = Column(Boolean, default=True)
     response_time_ms = Column(Integer, nullable=True)
     ip_address = Column(String(50), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    auto_tx_recorded = Column(Boolean, default=False, server_default=false(), nullable=False)
+    created_at = Column(DateTime, default=utcnow)
     
     __table_args__ = (
         Index('idx_chat_logs_boutique', 'boutique_id', 'created_at'),
+        Index('idx_chat_logs_auto_tx', 'boutique_id', 'created_at', sqlite_where=text("auto_tx_recorded = 1"), postgresql_where=text("auto_tx_recorded")),
     )
 
 class FrequentDepense(Base):
@@ -219,11 +290,12 @@ class FrequentDepense(Base):
     categorie = Column(String(50), nullable=False)
     montant_bucket = Column(Integer, nullable=False)
     usage_count = Column(Integer, default=1)
-    last_used_at = Column(DateTime, default=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     __table_args__ = (
         Index('idx_frequent_depenses_boutique', 'boutique_id', 'usage_count'),
+        Index('uq_frequent_depenses_bucket', 'boutique_id', 'categorie', 'montant_bucket', unique=True),
     )
 
 class DepenseCategory(Base):
@@ -236,8 +308,19 @@ class DepenseCategory(Base):
     usage_count = Column(Integer, default=0)
     active = Column(Boolean, default=True)
     deleted_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
     
     __table_args__ = (
         Index('idx_depense_categories_boutique', 'boutique_id', 'usage_count'),
     )
+
+class DailyBoutiqueStats(Base):
+    __tablename__ = "daily_boutique_stats"
+    
+    boutique_id = Column(String(32), ForeignKey("boutiques.id", ondelete="CASCADE"), primary_key=True)
+    jour = Column(Date, primary_key=True)
+    ventes_total = Column(Integer, default=0, nullable=False)
+    ventes_count = Column(Integer, default=0, nullable=False)
+    depenses_total = Column(Integer, default=0, nullable=False)
+    depenses_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
@@ -0,0 +1,182 @@
+import threading
+from cachetools import TTLCache
+from sqlalchemy import select, insert, update, func, bindparam, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from datetime import date
+from sqlalchemy.sql.functions import FunctionElement
+
+from .models import Vente, Depense, Dette, Produit, FrequentDepense, DepenseCategory, DailyBoutiqueStats, utcnow, normalize_nom
+
+class jours_depuis(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+@compiles(jours_depuis)
+def _jours_depuis_sqlite(element, compiler, **kw):
+    return "CAST(julianday('now') - julianday(%s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+@compiles(jours_depuis, "postgresql")
+def _jours_depuis_postgresql(element, compiler, **kw):
+    return "CAST(EXTRACT(DAY FROM (now() AT TIME ZONE 'utc') - %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+dettes_en_cours_total = select(func.coalesce(func.sum(Dette.montant_restant), 0)).where(
+    Dette.boutique_id == bindparam("boutique_id"),
+    Dette.statut == 'en_cours',
+    Dette.deleted_at == None
+)
+
+dettes_critiques_count = select(func.count(Dette.id)).where(
+    Dette.boutique_id == bindparam("boutique_id"),
+    Dette.statut == 'en_cours',
+    Dette.date_creation <= bindparam("limite_critique"),
+    Dette.deleted_at == None
+)
+
+stock_alertes_count = select(func.count(Produit.id)).where(
+    Produit.boutique_id == bindparam("boutique_id"),
+    Produit.quantite_stock <= Produit.seuil_alerte,
+    Produit.active == True,
+    Produit.deleted_at == None
+)
+
+def _stats_total(column, *criteria):
+    return select(func.coalesce(func.sum(column), 0)).where(
+        DailyBoutiqueStats.boutique_id == bindparam("boutique_id"),
+        *criteria
+    ).scalar_subquery()
+
+dashboard_totaux = select(
+    _stats_total(DailyBoutiqueStats.ventes_total, DailyBoutiqueStats.jour == bindparam("jour")).label("ventes_aujourdhui"),
+    _stats_total(DailyBoutiqueStats.depenses_total, DailyBoutiqueStats.jour == bindparam("jour")).label("depenses_aujourdhui"),
+    dettes_en_cours_total.scalar_subquery().label("dettes_totales"),
+    dettes_critiques_count.scalar_subquery().label("dettes_critiques"),
+    stock_alertes_count.scalar_subquery().label("stock_alertes")
+)
+
+cecile_totaux = select(
+    _stats_total(DailyBoutiqueStats.ventes_total, DailyBoutiqueStats.jour == bindparam("jour")).label("ventes_aujourdhui"),
+    dettes_en_cours_total.scalar_subquery().label("dettes_totales"),
+    stock_alertes_count.scalar_subquery().label("stock_alertes")
+)
+
+chatbot_totaux = select(
+    _stats_total(DailyBoutiqueStats.ventes_total, DailyBoutiqueStats.jour == bindparam("jour")).label("ventes_aujourdhui"),
+    _stats_total(DailyBoutiqueStats.depenses_total, DailyBoutiqueStats.jour == bindparam("jour")).label("depenses_aujourdhui"),
+    _stats_total(DailyBoutiqueStats.ventes_total, DailyBoutiqueStats.jour >= bindparam("depuis")).label("ventes_semaine"),
+    _stats_total(DailyBoutiqueStats.depenses_total, DailyBoutiqueStats.jour >= bindparam("depuis")).label("depenses_semaine")
+)
+
+ventes_count = select(func.count(Vente.id)).where(
+    Vente.boutique_id == bindparam("boutique_id"),
+    Vente.deleted_at == None
+)
+
+depenses_count = select(func.count(Depense.id)).where(
+    Depense.boutique_id == bindparam("boutique_id"),
+    Depense.deleted_at == None
+)
+
+PRODUITS_CACHE_TTL_SECONDS = 300
+
+# boutique_id -> (produits actifs, index nom normalisé -> produit) ; le TTL
+# rattrape les créations/suppressions faites par les autres workers.
+_catalogues = TTLCache(maxsize=5_000, ttl=PRODUITS_CACHE_TTL_SECONDS)
+_catalogues_lock = threading.Lock()
+
+def produits_catalogue(db: Session, boutique_id: str) -> tuple[list, dict]:
+    with _catalogues_lock:
+        catalogue = _catalogues.get(boutique_id)
+    if catalogue is None:
+        produits = [{"id": p.id, "nom": p.nom, "prix_unitaire": p.prix_unitaire} for p in db.query(
+            Produit.id, Produit.nom, Produit.prix_unitaire
+        ).filter(
+            Produit.boutique_id == boutique_id,
+            Produit.active == True,
+            Produit.deleted_at == None
+        )]
+        par_nom = {}
+        for p in produits:
+            par_nom.setdefault(normalize_nom(p["nom"]), p)
+        catalogue = (produits, par_nom)
+        with _catalogues_lock:
+            _catalogues[boutique_id] = catalogue
+    return catalogue
+
+def invalidate_produits_catalogue(boutique_id: str):
+    with _catalogues_lock:
+        _catalogues.pop(boutique_id, None)
+
+def _insert(db: Session):
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def upsert_frequent_depense(db: Session, boutique_id: str, categorie: str, montant_bucket: int):
+    stmt = _insert(db)(FrequentDepense).values(
+        boutique_id=boutique_id,
+        categorie=categorie,
+        montant_bucket=montant_bucket,
+        usage_count=1,
+        last_used_at=utcnow()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["boutique_id", "categorie", "montant_bucket"],
+        set_={
+            "usage_count": FrequentDepense.usage_count + 1,
+            "last_used_at": stmt.excluded.last_used_at
+        }
+    ))
+
+def increment_category_usage(db: Session, boutique_id: str, nom: str):
+    db.execute(update(DepenseCategory).where(
+        DepenseCategory.boutique_id == boutique_id,
+        DepenseCategory.nom == nom,
+        DepenseCategory.deleted_at == None
+    ).values(usage_count=func.coalesce(DepenseCategory.usage_count, 0) + 1).execution_options(synchronize_session=False))
+
+def add_daily_stats(db: Session, boutique_id: str, jour: date, ventes_total: int = 0, ventes_count: int = 0, depenses_total: int = 0, depenses_count: int = 0):
+    stmt = _insert(db)(DailyBoutiqueStats).values(
+        boutique_id=boutique_id,
+        jour=jour,
+        ventes_total=ventes_total,
+        ventes_count=ventes_count,
+        depenses_total=depenses_total,
+        depenses_count=depenses_count,
+        updated_at=utcnow()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["boutique_id", "jour"],
+        set_={
+            "ventes_total": DailyBoutiqueStats.ventes_total + stmt.excluded.ventes_total,
+            "ventes_count": DailyBoutiqueStats.ventes_count + stmt.excluded.ventes_count,
+            "depenses_total": DailyBoutiqueStats.depenses_total + stmt.excluded.depenses_total,
+            "depenses_count": DailyBoutiqueStats.depenses_count + stmt.excluded.depenses_count,
+            "updated_at": stmt.excluded.updated_at
+        }
+    ))
+
+def rebuild_daily_stats(db: Session):
+    stats = {}
+    jour_vente = func.date(Vente.date_vente)
+    for boutique_id, jour, total, count in db.query(
+        Vente.boutique_id, jour_vente, func.sum(Vente.montant_total), func.count(Vente.id)
+    ).filter(Vente.deleted_at == None).group_by(Vente.boutique_id, jour_vente):
+        stats[(boutique_id, str(jour))] = [total, count, 0, 0]
+    
+    jour_depense = func.date(Depense.date_depense)
+    for boutique_id, jour, total, count in db.query(
+        Depense.boutique_id, jour_depense, func.sum(Depense.montant), func.count(Depense.id)
+    ).filter(Depense.deleted_at == None).group_by(Depense.boutique_id, jour_depense):
+        stats.setdefault((boutique_id, str(jour)), [0, 0, 0, 0])[2:] = [total, count]
+    
+    db.query(DailyBoutiqueStats).delete(synchronize_session=False)
+    if stats:
+        db.execute(insert(DailyBoutiqueStats), [{
+            "boutique_id": boutique_id,
+            "jour": date.fromisoformat(jour),
+            "ventes_total": v[0],
+            "ventes_count": v[1],
+            "depenses_total": v[2],
+            "depenses_count": v[3]
+        } for (boutique_id, jour), v in stats.items()])
+    db.commit()
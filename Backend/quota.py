@@ -0,0 +1,42 @@
+import threading
+from cachetools import TTLCache
+from datetime import datetime
+from typing import Callable, Optional
+
+from .models import utcnow
+
+QUOTA_CACHE_TTL_SECONDS = 300
+
+# (type, boutique_id, mois) -> [compteur]; le TTL force une relecture en base
+# pour rattraper les écritures des autres workers. Le quota est donc garanti par
+# processus seulement : entre deux relectures, chaque worker réserve sur sa propre copie.
+_counters = TTLCache(maxsize=20_000, ttl=QUOTA_CACHE_TTL_SECONDS)
+_counters_lock = threading.Lock()
+
+def month_start() -> datetime:
+    return utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _key(kind: str, boutique_id: str) -> tuple:
+    return (kind, boutique_id, month_start().strftime("%Y%m"))
+
+def _counter(key: tuple, count_since: Callable[[datetime], int]) -> list:
+    with _counters_lock:
+        counter = _counters.get(key)
+    if counter is None:
+        count = count_since(month_start())
+        with _counters_lock:
+            counter = _counters.setdefault(key, [count])
+    return counter
+
+def reserve(kind: str, boutique_id: str, limit: int, count_since: Callable[[datetime], int]) -> Optional[int]:
+    # Vérifie et consomme une unité sous le même verrou ; None si le quota est atteint.
+    counter = _counter(_key(kind, boutique_id), count_since)
+    with _counters_lock:
+        if counter[0] >= limit:
+            return None
+        counter[0] += 1
+        return counter[0]
+
+def reset(kind: str, boutique_id: str):
+    with _counters_lock:
+        _counters.pop(_key(kind, boutique_id), None)
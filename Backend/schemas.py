@@ -1,29 +1,35 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
 from typing import Optional, List
 from datetime import datetime
 import re
 
+TELEPHONE_RE = re.compile(r'^0[0-9]{8,9}$')
+OBJECTIF_TYPES = ('journalier', 'hebdomadaire', 'mensuel')
+
 class SignupRequest(BaseModel):
     nom_boutique: str = Field(..., min_length=3, max_length=100)
     telephone: str = Field(..., min_length=8, max_length=20)
     pin: str = Field(..., min_length=4, max_length=4)
     pin_confirm: str = Field(..., min_length=4, max_length=4)
     
-    @validator('telephone')
-    def validate_telephone(cls, v):
-        if not re.match(r'^0[0-9]{8,9}$', v):
+    @field_validator('telephone')
+    @classmethod
+    def validate_telephone(cls, v: str) -> str:
+        if not TELEPHONE_RE.match(v):
             raise ValueError('Format téléphone invalide (ex: 0701234567)')
         return v
     
-    @validator('pin')
-    def validate_pin(cls, v):
-        if not v.isdigit():
+    @field_validator('pin')
+    @classmethod
+    def validate_pin(cls, v: str) -> str:
+        if not (v.isascii() and v.isdigit()):
             raise ValueError('Le PIN doit contenir uniquement des chiffres')
         return v
     
-    @validator('pin_confirm')
-    def validate_pin_confirm(cls, v, values):
-        if 'pin' in values and v != values['pin']:
+    @field_validator('pin_confirm')
+    @classmethod
+    def validate_pin_confirm(cls, v: str, info: ValidationInfo) -> str:
+        if 'pin' in info.data and v != info.data['pin']:
             raise ValueError('Les PINs ne correspondent pas')
         return v
 
@@ -64,22 +70,26 @@ class ProduitResponse(BaseModel):
     seuil_alerte: int
     categorie: Optional[str]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class VenteCreate(BaseModel):
     produit_id: str
     quantite: int = Field(..., ge=1)
 
+class VenteProduit(BaseModel):
+    id: str
+    nom: str
+    
+    model_config = ConfigDict(from_attributes=True)
+
 class VenteResponse(BaseModel):
     id: str
-    produit: dict
+    produit: VenteProduit
     quantite: int
     montant_total: int
     date_vente: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DepenseCreate(BaseModel):
     categorie: str = Field(...)
@@ -93,8 +103,7 @@ class DepenseResponse(BaseModel):
     description: Optional[str]
     date_depense: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DetteCreate(BaseModel):
     nom_client: str = Field(..., min_length=2, max_length=100)
@@ -111,8 +120,7 @@ class DetteResponse(BaseModel):
     statut: str
     jours_depuis_creation: int = 0
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PaiementDetteCreate(BaseModel):
     montant_paye: int = Field(..., ge=1)
@@ -123,11 +131,11 @@ class ObjectifCreate(BaseModel):
     date_debut: datetime
     date_fin: datetime
     
-    @validator('type')
-    def validate_type(cls, v):
-        types = ['journalier', 'hebdomadaire', 'mensuel']
-        if v not in types:
-            raise ValueError(f'Type doit être: {", ".join(types)}')
+    @field_validator('type')
+    @classmethod
+    def validate_type(cls, v: str) -> str:
+        if v not in OBJECTIF_TYPES:
+            raise ValueError(f'Type doit être: {", ".join(OBJECTIF_TYPES)}')
         return v
 
 class VoiceParseRequest(BaseModel):
@@ -185,8 +193,7 @@ class FrequentDepenseResponse(BaseModel):
     montant: int
     usage_count: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DepenseCategoryCreate(BaseModel):
     nom: str = Field(..., min_length=2, max_length=50)
@@ -198,5 +205,27 @@ class DepenseCategoryResponse(BaseModel):
     icone: str
     usage_count: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class TransactionDetails(BaseModel):
+    produit_nom: Optional[str]
+    quantite: Optional[float]
+    prix_unitaire: Optional[int]
+    montant_total: Optional[int]
+    client_nom: Optional[str]
+    description: Optional[str]
+    categorie: Optional[str]
+
+class TransactionIntent(BaseModel):
+    has_transaction: bool
+    transaction_type: Optional[str]
+    details: TransactionDetails
+    confidence: float
+    missing_info: List[str]
+
+class VoiceParseResult(BaseModel):
+    success: bool
+    produit_nom: Optional[str]
+    quantite: Optional[int]
+    prix_unitaire: Optional[int]
+    confiance: float
@@ -4,22 +4,32 @@ import os
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-backend_process = subprocess.Popen(
-    [sys.executable, "-m", "uvicorn", "backend.app.main:app", "--host", "0.0.0.0", "--port", "8000", "--reload"],
-    stdout=sys.stdout,
-    stderr=sys.stderr
-)
+if os.environ.get("ENV", "dev") == "prod":
+    # Plusieurs workers, sans rechargement ; uvloop/httptools sont utilisés s'ils sont installés.
+    workers = os.environ.get("WORKERS") or str(os.cpu_count() or 2)
+    # Migration une seule fois, avant que les workers démarrent en parallèle.
+    from Backend.migrate import migrate
+    migrate()
+    sys.exit(subprocess.call(
+        [sys.executable, "-m", "uvicorn", "Backend.main:app", "--host", "0.0.0.0", "--port", os.environ.get("PORT", "8000"),
+         "--workers", workers, "--loop", "auto", "--http", "auto"],
+        env={**os.environ, "AUTO_MIGRATE": "0"}
+    ))
 
-os.chdir("frontend")
-frontend_process = subprocess.Popen(
-    ["npm", "run", "dev"],
-    stdout=sys.stdout,
-    stderr=sys.stderr
+backend_process = subprocess.Popen(
+    [sys.executable, "-m", "uvicorn", "Backend.main:app", "--host", "0.0.0.0", "--port", "8000", "--reload"]
 )
+frontend_process = subprocess.Popen(["npm", "run", "dev"], cwd="Frontend")
+processes = [backend_process, frontend_process]
 
 try:
-    backend_process.wait()
-    frontend_process.wait()
+    # On s'arrête dès que l'un des deux processus se termine.
+    os.wait()
 except KeyboardInterrupt:
-    backend_process.terminate()
-    frontend_process.terminate()
+    pass
+finally:
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        process.wait()
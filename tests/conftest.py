@@ -0,0 +1,63 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# La base SQLite est relative au répertoire courant : chaque exécution travaille sur une base neuve.
+os.chdir(tempfile.mkdtemp(prefix="djassa-tests-"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from fastapi.testclient import TestClient
+
+from Backend import gemini_service
+import Backend.main as main
+
+_telephones = itertools.count(1)
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModels:
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def generate_content(self, model, contents, config=None):
+        return FakeResponse("".join(self.chunks))
+    
+    async def generate_content_stream(self, model, contents, config=None):
+        async def stream():
+            for chunk in self.chunks:
+                yield FakeResponse(chunk)
+        return stream()
+
+class FakeClient:
+    def __init__(self, chunks):
+        self.aio = type("Aio", (), {"models": FakeModels(chunks)})()
+        self.models = self.aio.models
+
+@pytest.fixture(scope="session")
+def client():
+    main.limiter.enabled = False
+    with TestClient(main.app) as c:
+        yield c
+
+@pytest.fixture
+def boutique(client):
+    r = client.post("/api/auth/signup", json={
+        "nom_boutique": "Chez Awa",
+        "telephone": f"07{next(_telephones):08d}",
+        "pin": "1234",
+        "pin_confirm": "1234"
+    })
+    assert r.status_code == 200, r.text
+    data = r.json()
+    return {"id": data["boutique_id"], "token": data["token"], "headers": {"Authorization": f"Bearer {data['token']}"}}
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeClient(["Salut, ", "je suis ", "Cécile"])
+    monkeypatch.setattr(gemini_service, "get_client", lambda: fake)
+    monkeypatch.setattr(main, "get_client", lambda: fake)
+    return fake
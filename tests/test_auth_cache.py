@@ -0,0 +1,39 @@
+from Backend import auth
+from Backend.database import SessionLocal
+from Backend.models import Boutique, Session as SessionModel
+
+def test_session_revoquee_evincee(client, boutique):
+    h = boutique["headers"]
+    assert client.get("/api/dashboard", headers=h).status_code == 200
+    assert auth.hash_token(boutique["token"]) in auth._auth_cache
+    
+    with SessionLocal() as db:
+        db.query(SessionModel).filter(SessionModel.boutique_id == boutique["id"]).one().revoked = True
+        db.commit()
+    
+    assert auth.hash_token(boutique["token"]) not in auth._auth_cache
+    assert client.get("/api/dashboard", headers=h).status_code == 401
+
+def test_boutique_desactivee_evincee(client, boutique):
+    h = boutique["headers"]
+    assert client.get("/api/dashboard", headers=h).status_code == 200
+    
+    with SessionLocal() as db:
+        db.get(Boutique, boutique["id"]).active = False
+        db.commit()
+    
+    assert client.get("/api/dashboard", headers=h).status_code == 401
+
+def test_prune_evince_sessions_revoquees(client, boutique):
+    h = boutique["headers"]
+    assert client.get("/api/dashboard", headers=h).status_code == 200
+    
+    # Révocation en masse : aucun événement ORM, seul prune_sessions doit vider le cache.
+    with SessionLocal() as db:
+        db.query(SessionModel).filter(SessionModel.boutique_id == boutique["id"]).update({"revoked": True})
+        db.commit()
+    assert auth.hash_token(boutique["token"]) in auth._auth_cache
+    
+    assert auth.prune_sessions() >= 1
+    assert auth.hash_token(boutique["token"]) not in auth._auth_cache
+    assert client.get("/api/dashboard", headers=h).status_code == 401
@@ -0,0 +1,37 @@
+import Backend.main as main
+
+def _stream(client, headers, message="salut"):
+    with client.stream("POST", "/api/chat/cecile/stream", json={"message": message}, headers=headers) as r:
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/event-stream")
+        return "".join(r.iter_text())
+
+def test_stream_cecile(client, boutique, gemini):
+    h = boutique["headers"]
+    body = _stream(client, h)
+    
+    assert "data: Salut, \n\n" in body
+    assert "data: Cécile\n\n" in body
+    assert body.endswith("event: done\ndata: 19\n\n")
+    
+    historique = client.get("/api/chat/history", headers=h).json()
+    assert [(m["role"], m["content"]) for m in historique] == [("user", "salut"), ("assistant", "Salut, je suis Cécile")]
+
+def test_stream_erreur_masquee(client, boutique, gemini, monkeypatch):
+    async def panne(*args, **kwargs):
+        raise RuntimeError("détail interne")
+        yield
+    monkeypatch.setattr(main, "stream_chat_with_cecile", panne)
+    
+    body = _stream(client, boutique["headers"])
+    
+    assert f"event: error\ndata: {main.CECILE_STREAM_ERROR}\n\n" in body
+    assert "détail interne" not in body
+
+def test_stream_quota_atteint(client, boutique, gemini, monkeypatch):
+    monkeypatch.setattr(main, "CHAT_QUOTA_GRATUIT", 1)
+    h = boutique["headers"]
+    _stream(client, h)
+    
+    r = client.post("/api/chat/cecile/stream", json={"message": "encore"}, headers=h)
+    assert r.status_code == 429
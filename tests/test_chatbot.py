@@ -0,0 +1,28 @@
+import Backend.main as main
+from Backend.database import SessionLocal
+from Backend.models import ChatLog
+
+def test_limite_transactions_automatiques(client, boutique, gemini, monkeypatch):
+    async def reponse(prompt, use_cache=True):
+        return '{"response": "Bonjour !", "suggestions": []}'
+    async def intention(message, produits, language="fr"):
+        return {"has_transaction": True, "transaction_type": "vente", "confidence": 0.95,
+                "details": {"produit_nom": "riz", "quantite": 1}}
+    monkeypatch.setattr(main, "generate_chatbot_response", reponse)
+    monkeypatch.setattr(main, "detect_transaction_intent", intention)
+    
+    h = boutique["headers"]
+    client.post("/api/produits", json={"nom": "Riz", "prix_unitaire": 1000, "quantite_stock": 50}, headers=h)
+    
+    for _ in range(10):
+        r = client.post("/api/chatbot/message", json={"message": "vendu 1 riz"}, headers=h).json()
+        assert r["transaction_recorded"]["type"] == "vente"
+    
+    # Les ChatLog sont écrits dans la requête : la 11e les voit sans attendre la file d'audit.
+    r = client.post("/api/chatbot/message", json={"message": "vendu 1 riz"}, headers=h).json()
+    assert "transaction_recorded" not in r
+    assert "Trop de transactions automatiques" in r["response"]
+    
+    with SessionLocal() as db:
+        assert db.query(ChatLog).filter(ChatLog.boutique_id == boutique["id"]).count() == 11
+    assert client.get("/api/ventes/count", headers=h).json()["total"] == 10
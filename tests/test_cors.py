@@ -0,0 +1,9 @@
+def test_origine_joker_sans_credentials(client):
+    r = client.options("/api/dashboard", headers={
+        "Origin": "https://exemple.ci",
+        "Access-Control-Request-Method": "GET",
+        "Access-Control-Request-Headers": "Authorization"
+    })
+    assert r.status_code == 200
+    assert r.headers["access-control-allow-origin"] == "*"
+    assert "access-control-allow-credentials" not in r.headers
@@ -0,0 +1,61 @@
+from sqlalchemy import func
+
+from Backend import queries
+from Backend.database import SessionLocal
+from Backend.models import DailyBoutiqueStats, Depense, Vente
+
+def _stats(boutique_id):
+    with SessionLocal() as db:
+        return [(s.jour, s.ventes_total, s.ventes_count, s.depenses_total, s.depenses_count) for s in db.query(DailyBoutiqueStats).filter(
+            DailyBoutiqueStats.boutique_id == boutique_id
+        ).order_by(DailyBoutiqueStats.jour)]
+
+def _agregats(boutique_id):
+    with SessionLocal() as db:
+        ventes = db.query(func.coalesce(func.sum(Vente.montant_total), 0), func.count(Vente.id)).filter(
+            Vente.boutique_id == boutique_id,
+            Vente.deleted_at == None
+        ).one()
+        depenses = db.query(func.coalesce(func.sum(Depense.montant), 0), func.count(Depense.id)).filter(
+            Depense.boutique_id == boutique_id,
+            Depense.deleted_at == None
+        ).one()
+    return (*ventes, *depenses)
+
+def test_stats_suivent_ventes_et_depenses(client, boutique):
+    h = boutique["headers"]
+    produit = client.post("/api/produits", json={"nom": "Riz", "prix_unitaire": 15000, "quantite_stock": 10}, headers=h).json()
+    
+    v1 = client.post("/api/ventes", json={"produit_id": produit["id"], "quantite": 2}, headers=h).json()
+    client.post("/api/ventes", json={"produit_id": produit["id"], "quantite": 1}, headers=h)
+    d1 = client.post("/api/depenses", json={"categorie": "Transport", "montant": 1200}, headers=h).json()
+    client.post("/api/depenses", json={"categorie": "Loyer", "montant": 5000}, headers=h)
+    
+    stats = _stats(boutique["id"])
+    assert len(stats) == 1
+    assert stats[0][1:] == (45000, 2, 6200, 2)
+    assert stats[0][1:] == _agregats(boutique["id"])
+    
+    assert client.delete(f"/api/ventes/{v1['vente_id']}", headers=h).status_code == 200
+    assert client.delete(f"/api/depenses/{d1['id']}", headers=h).status_code == 200
+    
+    stats = _stats(boutique["id"])
+    assert stats[0][1:] == (15000, 1, 5000, 1)
+    assert stats[0][1:] == _agregats(boutique["id"])
+    
+    dashboard = client.get("/api/dashboard", headers=h).json()
+    assert dashboard["ventes_aujourdhui"] == 15000
+    assert dashboard["depenses_aujourdhui"] == 5000
+
+def test_rebuild_identique_aux_ecritures(client, boutique):
+    h = boutique["headers"]
+    produit = client.post("/api/produits", json={"nom": "Savon", "prix_unitaire": 500, "quantite_stock": 10}, headers=h).json()
+    vente = client.post("/api/ventes", json={"produit_id": produit["id"], "quantite": 3}, headers=h).json()
+    client.post("/api/ventes", json={"produit_id": produit["id"], "quantite": 1}, headers=h)
+    client.post("/api/depenses", json={"categorie": "Transport", "montant": 700}, headers=h)
+    client.delete(f"/api/ventes/{vente['vente_id']}", headers=h)
+    
+    avant = _stats(boutique["id"])
+    with SessionLocal() as db:
+        queries.rebuild_daily_stats(db)
+    assert _stats(boutique["id"]) == avant
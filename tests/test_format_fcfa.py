@@ -0,0 +1,8 @@
+from Backend.gemini_service import format_fcfa
+
+def test_format_fcfa():
+    assert format_fcfa(0) == "0 FCFA"
+    assert format_fcfa(999) == "999 FCFA"
+    assert format_fcfa(1000) == "1 000 FCFA"
+    assert format_fcfa(1234567) == "1 234 567 FCFA"
+    assert format_fcfa(-5000) == "-5 000 FCFA"
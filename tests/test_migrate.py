@@ -0,0 +1,78 @@
+import hashlib
+import logging
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect, text
+
+from Backend import auth
+from Backend.database import SessionLocal, engine
+from Backend.migrate import migrate
+from Backend.models import FrequentDepense, Vente
+
+def test_migrate_fusionne_les_buckets_en_double(client, boutique):
+    # Base antérieure à l'index unique : doublons possibles.
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_frequent_depenses_bucket"))
+    with SessionLocal() as db:
+        for i, usage in enumerate((2, 3, 4)):
+            db.add(FrequentDepense(
+                boutique_id=boutique["id"], categorie="Transport", montant_bucket=1000, usage_count=usage,
+                created_at=datetime(2025, 1, 1 + i), last_used_at=datetime(2025, 2, 1 + i)
+            ))
+        db.add(FrequentDepense(boutique_id=boutique["id"], categorie="Loyer", montant_bucket=5000, usage_count=1))
+        db.commit()
+    
+    migrate()
+    
+    with SessionLocal() as db:
+        lignes = db.query(FrequentDepense).filter(FrequentDepense.boutique_id == boutique["id"]).order_by(FrequentDepense.categorie).all()
+        assert [(l.categorie, l.usage_count) for l in lignes] == [("Loyer", 1), ("Transport", 9)]
+        assert lignes[1].last_used_at == datetime(2025, 2, 3)
+    assert "uq_frequent_depenses_bucket" in {i["name"] for i in inspect(engine).get_indexes("frequent_depenses")}
+    
+    # Les dépenses suivantes retombent bien sur la ligne fusionnée.
+    client.post("/api/depenses", json={"categorie": "Transport", "montant": 1200}, headers=boutique["headers"])
+    with SessionLocal() as db:
+        assert db.query(FrequentDepense.usage_count).filter(
+            FrequentDepense.boutique_id == boutique["id"],
+            FrequentDepense.categorie == "Transport"
+        ).scalar() == 10
+
+def test_migrate_convertit_les_token_hash_hexadecimaux(client, boutique):
+    ancien = hashlib.sha256(boutique["token"].encode()).hexdigest()
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE sessions SET token_hash = :h WHERE boutique_id = :b"), {"h": ancien, "b": boutique["id"]})
+    auth._auth_cache.clear()
+    assert client.get("/api/dashboard", headers=boutique["headers"]).status_code == 401
+    
+    migrate()
+    migrate()
+    
+    with engine.connect() as conn:
+        stocke = conn.execute(text("SELECT token_hash FROM sessions WHERE boutique_id = :b"), {"b": boutique["id"]}).scalar()
+    assert stocke == auth.hash_token(boutique["token"])
+    assert client.get("/api/dashboard", headers=boutique["headers"]).status_code == 200
+
+def test_migrate_signale_les_ventes_incoherentes(client, boutique, caplog):
+    produit = client.post("/api/produits", json={"nom": "Riz", "prix_unitaire": 1000, "quantite_stock": 10}, headers=boutique["headers"]).json()
+    # Base antérieure à ck_ventes_montant_total : la contrainte n'existe pas.
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA ignore_check_constraints = ON")
+        conn.execute(text(
+            "INSERT INTO ventes (id, boutique_id, produit_id, quantite, prix_unitaire, montant_total) "
+            "VALUES ('vente-incoherente', :b, :p, 2, 1000, 1500)"
+        ), {"b": boutique["id"], "p": produit["id"]})
+        conn.exec_driver_sql("PRAGMA ignore_check_constraints = OFF")
+    
+    with caplog.at_level(logging.WARNING, logger="Backend.migrate"):
+        migrate()
+    assert "vente-incoherente" in caplog.text
+    
+    with SessionLocal() as db:
+        db.add(Vente(boutique_id=boutique["id"], produit_id=produit["id"], quantite=2, prix_unitaire=1000, montant_total=1500))
+        with pytest.raises(ValueError):
+            db.flush()
+        db.rollback()
+        db.query(Vente).filter(Vente.id == "vente-incoherente").delete()
+        db.commit()
@@ -0,0 +1,25 @@
+def test_ventes_has_next(client, boutique):
+    h = boutique["headers"]
+    produit = client.post("/api/produits", json={"nom": "Riz", "prix_unitaire": 1000, "quantite_stock": 10}, headers=h).json()
+    for _ in range(3):
+        client.post("/api/ventes", json={"produit_id": produit["id"], "quantite": 1}, headers=h)
+    
+    page = client.get("/api/ventes?limit=2", headers=h).json()
+    assert len(page["ventes"]) == 2 and page["has_next"]
+    
+    page = client.get("/api/ventes?limit=2&offset=2", headers=h).json()
+    assert len(page["ventes"]) == 1 and not page["has_next"]
+    
+    page = client.get("/api/ventes?limit=3", headers=h).json()
+    assert len(page["ventes"]) == 3 and not page["has_next"]
+
+def test_depenses_has_next(client, boutique):
+    h = boutique["headers"]
+    for montant in (500, 1000, 1500):
+        client.post("/api/depenses", json={"categorie": "Transport", "montant": montant}, headers=h)
+    
+    page = client.get("/api/depenses?limit=2", headers=h).json()
+    assert len(page["depenses"]) == 2 and page["has_next"]
+    
+    page = client.get("/api/depenses?limit=2&offset=2", headers=h).json()
+    assert len(page["depenses"]) == 1 and not page["has_next"]
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from Backend import quota
+
+def test_reserve_jusqu_a_la_limite():
+    lectures = []
+    def count_since(since):
+        lectures.append(since)
+        return 1
+    
+    assert quota.reserve("test", "b-limite", 3, count_since) == 2
+    assert quota.reserve("test", "b-limite", 3, count_since) == 3
+    assert quota.reserve("test", "b-limite", 3, count_since) is None
+    # Le compteur n'est lu en base qu'une fois, puis tenu en mémoire.
+    assert len(lectures) == 1
+
+def test_reserve_concurrente():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        resultats = list(pool.map(lambda _: quota.reserve("test", "b-concurrent", 10, lambda since: 0), range(50)))
+    
+    accordes = [r for r in resultats if r is not None]
+    assert sorted(accordes) == list(range(1, 11))
+
+def test_reset_relit_la_base():
+    assert quota.reserve("test", "b-reset", 1, lambda since: 0) == 1
+    assert quota.reserve("test", "b-reset", 1, lambda since: 0) is None
+    quota.reset("test", "b-reset")
+    assert quota.reserve("test", "b-reset", 1, lambda since: 0) == 1